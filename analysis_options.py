@@ -0,0 +1,16 @@
+# 解析の設定と出力形式（NumPyなどに依存しないため、GUIの画面を作る時点で読み込んでも起動が遅くならない）
+
+# 解析のパラメータ（既定値）
+WINDOW_SEC = 0.05  # 50ms
+HOP_SEC = 0.025    # 25ms
+
+# 周波数の求め方
+# "peak": 各フレームのスペクトルで振幅が最大の周波数（高調波や雑音を拾うことがある）
+# "yin": YINで推定した基本周波数（周期が見つからないフレームは 0Hz）
+PITCH_METHODS = ["peak", "yin"]
+
+# 解析結果の列名（作曲ツールの楽譜としてもこの列名で読み込まれる）
+ANALYSIS_HEADERS = ["時刻(hh:mm:ss:fff)", "周波数 (Hz)", "振幅 (dB)", "音階（国際式）", "音階（ドレミ式）"]
+
+# 対応している出力形式（拡張子）
+ANALYSIS_FORMATS = [".xlsx", ".csv", ".parquet"]
@@ -0,0 +1,231 @@
+import os
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.fft import rfft
+from note_mapping import frequencies_to_midi
+from pitch_detection import yin_frames
+from analysis_options import WINDOW_SEC, HOP_SEC, PITCH_METHODS, ANALYSIS_HEADERS, ANALYSIS_FORMATS
+
+def frame_signal(audio_data, window_size, hop_size):
+    """信号をコピーせずに (フレーム数, window_size) のフレーム行列として見る（stride tricks）
+
+    フレームの開始位置は range(0, len(audio_data) - window_size, hop_size) と同じ。
+    戻り値は読み取り専用のビュー。
+    """
+    audio_data = np.ascontiguousarray(audio_data)
+    n_frames = len(range(0, len(audio_data) - window_size, hop_size))
+    stride = audio_data.strides[0]
+    return as_strided(audio_data, shape=(n_frames, window_size),
+                      strides=(hop_size * stride, stride), writeable=False)
+
+def _analyze_frame_matrix(frames, sample_rate, window_size, batch_frames=2048, progress=None, method="peak"):
+    """フレーム行列をバッチごとにrFFTし、(最大振幅, 周波数) の配列を返す（周波数の求め方は method で選ぶ）"""
+    if method not in PITCH_METHODS:
+        raise ValueError(f"未対応の周波数推定方法です: {method}（対応: {', '.join(PITCH_METHODS)}）")
+    n_frames = len(frames)
+
+    # 正の周波数のビンのみ使用（直流成分とナイキスト周波数は除外）
+    first_bin, last_bin = 1, (window_size + 1) // 2
+    bin_freqs = np.arange(first_bin, last_bin) * (sample_rate / window_size)
+
+    amplitude = np.empty(n_frames, dtype=np.float64)
+    peak_bin = np.empty(n_frames, dtype=np.int64)
+    f0 = np.empty(n_frames, dtype=np.float64) if method == "yin" else None
+    for begin in range(0, n_frames, batch_frames):
+        end = min(begin + batch_frames, n_frames)
+        # 従来の scipy.fft.fft と同じく float64 で計算する（int16 の振幅は 1e7 程度になり、float32 では
+        # 小数第1位の振幅や最大値の比較が従来と一致しない）。メモリ使用量は batch_frames で抑えている
+        spectrum = np.abs(rfft(frames[begin:end].astype(np.float64), axis=1, workers=-1)[:, first_bin:last_bin])
+        peak_bin[begin:end] = np.argmax(spectrum, axis=1)
+        amplitude[begin:end] = spectrum[np.arange(end - begin), peak_bin[begin:end]]
+        if f0 is not None:
+            f0[begin:end], _ = yin_frames(frames[begin:end], sample_rate)
+        if progress is not None:
+            progress(end / n_frames * 100)
+
+    # 振幅が0のフレームは周波数なし（0Hz）として扱う
+    frequency = np.where(amplitude > 0, bin_freqs[peak_bin] if f0 is None else f0, 0.0)
+    return amplitude, frequency
+
+def _frame_result(first_frame, amplitude, frequency, hop_size, sample_rate):
+    """フレーム番号 first_frame から始まる解析結果の辞書を作成"""
+    frame_index = np.arange(first_frame, first_frame + len(amplitude))
+    return {
+        "time_ms": (frame_index * hop_size / sample_rate * 1000).astype(np.int64),
+        "frequency": frequency,
+        "amplitude": amplitude,
+        "midi": frequencies_to_midi(frequency),
+    }
+
+def iter_analyze_blocks(blocks, sample_rate, window_sec=WINDOW_SEC, hop_sec=HOP_SEC,
+                        batch_frames=2048, total_samples=None, progress=None, method="peak"):
+    """ブロックごとに届く音声（モノラルの1次元配列）を解析し、ブロックごとの解析結果を返すジェネレーター
+
+    各フレームの最大振幅とその周波数をバッチ単位のrFFTで求める。
+    ブロックの境界をまたぐ窓は前のブロックの残りと連結して解析するため、
+    結果は全体を一度に解析した場合と同じになる。保持するのは1ブロック＋1窓分だけ。
+    batch_frames: 1回のrFFTでまとめて処理するフレーム数（メモリ使用量の上限を決める）
+    progress: 読み込んだサンプル数から求めた進捗（0〜100）を受け取る関数（total_samples が必要）
+    method: 周波数の求め方（PITCH_METHODS のいずれか）
+    戻り値: 各フレームの time_ms（開始時刻, ms）, frequency（Hz）, amplitude（最大振幅）,
+            midi（MIDIノート番号, 振幅0のフレームは -1）を持つ辞書
+    """
+    window_size = int(window_sec * sample_rate)
+    hop_size = int(hop_sec * sample_rate)
+    pending = np.zeros(0, dtype=np.int16)  # まだ解析していない窓の先頭以降のサンプル
+    next_frame = 0
+    consumed = 0
+
+    for block in blocks:
+        pending = np.concatenate([pending, block]) if len(pending) else np.asarray(block)
+        consumed += len(block)
+
+        # 窓の終端が現在読み込んだ範囲に収まるフレームだけ解析し、残りは次のブロックへ持ち越す
+        frames = frame_signal(pending, window_size, hop_size)
+        if len(frames):
+            amplitude, frequency = _analyze_frame_matrix(frames, sample_rate, window_size, batch_frames,
+                                                         method=method)
+            yield _frame_result(next_frame, amplitude, frequency, hop_size, sample_rate)
+            next_frame += len(frames)
+            pending = pending[len(frames) * hop_size:]
+
+        if progress is not None and total_samples:
+            progress(min(consumed / total_samples * 100, 100))
+
+def format_time_ms(total_ms):
+    """ミリ秒を「hh:mm:ss:fff」形式の文字列に変換"""
+    hours = total_ms // 3600000
+    minutes = (total_ms % 3600000) // 60000
+    seconds = (total_ms % 60000) // 1000
+    milliseconds = total_ms % 1000
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}:{milliseconds:03d}"
+
+def moving_energy(data, window_size):
+    """全ての開始位置 i（0 <= i < len(data) - window_size）について sum(data[i:i+window_size]**2) を累積和で求める"""
+    squared = np.square(np.asarray(data, dtype=np.float64))
+    cumulative = np.concatenate([[0.0], np.cumsum(squared)])
+    n = max(len(squared) - window_size, 0)
+    return cumulative[window_size:window_size + n] - cumulative[:n]
+
+def find_loudest_segments(data, window_size, top_k=1, min_distance=None):
+    """エネルギーが大きい区間の開始位置を大きい順に最大 top_k 個返す
+
+    min_distance: 候補同士の開始位置の最小間隔（既定: window_size）。近すぎる候補は除外する
+    戻り値: (開始位置, エネルギー) のリスト
+    """
+    energy = moving_energy(data, window_size)
+    if len(energy) == 0:
+        return []
+    min_distance = window_size if min_distance is None else max(1, min_distance)
+
+    remaining = energy.copy()
+    candidates = []
+    for _ in range(top_k):
+        start = int(np.argmax(remaining))
+        if remaining[start] == -np.inf:
+            break
+        candidates.append((start, float(energy[start])))
+        remaining[max(0, start - min_distance + 1):start + min_distance] = -np.inf
+    return candidates
+
+def _check_format(path):
+    """保存先の拡張子を確認して返す"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in ANALYSIS_FORMATS:
+        raise ValueError(f"未対応の出力形式です: {ext}（対応形式: {', '.join(ANALYSIS_FORMATS)}）")
+    return ext
+
+def _format_columns(time_ms, frequency, amplitude, note_international, note_doremi):
+    """(時刻文字列, 周波数, 振幅, 国際式, ドレミ式) の列に整形
+
+    周波数・振幅は丸めていない値。無音（周波数0）のフレームは周波数が NaN、音階が None になる。
+    """
+    frequency = np.asarray(frequency, dtype=np.float64)
+    times = np.array([format_time_ms(int(ms)) for ms in time_ms], dtype=object)
+    silent = ~(frequency > 0)
+    return (times, np.where(silent, np.nan, frequency), np.asarray(amplitude, dtype=np.float64),
+            np.where(silent, None, np.asarray(note_international, dtype=object)),
+            np.where(silent, None, np.asarray(note_doremi, dtype=object)))
+
+def _columns_to_dataframe(columns):
+    """整形済みの列をDataFrameに変換（周波数と振幅は小数第1位に丸めた数値）"""
+    import pandas as pd
+
+    times, frequency, amplitude, note_international, note_doremi = columns
+    return pd.DataFrame(dict(zip(ANALYSIS_HEADERS, (
+        times, np.round(frequency, 1), np.round(amplitude, 1), note_international, note_doremi))))
+
+def _xlsx_rows(columns):
+    """整形済みの列をExcelの行に変換（従来と同じく周波数・振幅は文字列で記録）"""
+    times, frequency, amplitude, note_international, note_doremi = columns
+    frequency_text = [None if np.isnan(f) else f"{f:.1f}" for f in frequency]
+    amplitude_text = [f"{a:.1f}" for a in amplitude]
+    return zip(times, frequency_text, amplitude_text, note_international, note_doremi)
+
+class AnalysisStreamWriter:
+    """解析結果をチャンクが届くたびに書き出す（メモリに結果を溜めない）
+
+    with 文で使い、write() にチャンクを渡す。形式は保存先の拡張子（.xlsx / .csv / .parquet）で決まる。
+    .xlsx は書き込み専用モード（行は一時ファイルへ退避）、.csv は追記、.parquet は行グループ単位で書き出す。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ext = _check_format(path)
+        self.frames = 0
+        self._file = None
+        self._wb = None
+        self._ws = None
+        self._parquet = None
+
+        if self.ext == ".xlsx":
+            import openpyxl
+
+            self._wb = openpyxl.Workbook(write_only=True)
+            self._ws = self._wb.create_sheet("音声解析結果")
+            self._ws.append(ANALYSIS_HEADERS)
+        elif self.ext == ".csv":
+            self._file = open(path, "w", encoding="utf-8-sig", newline="")
+            self._file.write(",".join(ANALYSIS_HEADERS) + "\n")
+
+    def write(self, time_ms, frequency, amplitude, note_international, note_doremi):
+        """チャンクを書き出す（周波数が0のフレームは周波数と音階が空欄になる）"""
+        columns = _format_columns(time_ms, frequency, amplitude, note_international, note_doremi)
+        if self.ext == ".xlsx":
+            for row in _xlsx_rows(columns):
+                self._ws.append(row)
+        elif self.ext == ".csv":
+            _columns_to_dataframe(columns).to_csv(self._file, index=False, header=False, float_format="%.1f")
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            # 無音だけのチャンクでも型が変わらないよう、列の型を固定する
+            schema = pa.schema([(ANALYSIS_HEADERS[0], pa.string()), (ANALYSIS_HEADERS[1], pa.float64()),
+                                (ANALYSIS_HEADERS[2], pa.float64()), (ANALYSIS_HEADERS[3], pa.string()),
+                                (ANALYSIS_HEADERS[4], pa.string())])
+            table = pa.Table.from_pandas(_columns_to_dataframe(columns), schema=schema, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, schema)
+            self._parquet.write_table(table)
+        self.frames += len(columns[0])
+
+    def close(self):
+        """書き出しを完了してファイルを閉じる"""
+        if self._wb is not None:
+            self._wb.save(self.path)
+            self._wb = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+        elif self.ext == ".parquet" and self.frames == 0:
+            _columns_to_dataframe(_format_columns([], [], [], [], [])).to_parquet(self.path, index=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,119 @@
+import json
+import subprocess
+import numpy as np
+
+# ffmpeg / ffprobe の実行ファイル（PATHから探す）
+FFMPEG_BIN = "ffmpeg"
+FFPROBE_BIN = "ffprobe"
+
+class AudioDecodeError(Exception):
+    """ffmpeg / ffprobe での音声の読み込みに失敗したときの例外"""
+
+def probe_audio(path):
+    """最初の音声ストリームの (サンプリングレート, チャンネル数, 長さ[秒]) を返す（長さが不明なら None）"""
+    command = [FFPROBE_BIN, "-v", "error", "-select_streams", "a:0",
+               "-show_entries", "stream=sample_rate,channels:format=duration", "-of", "json", path]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise AudioDecodeError(f"ffprobeエラー：\n{result.stderr.decode(errors='replace')}")
+    info = json.loads(result.stdout)
+    if not info.get("streams"):
+        raise AudioDecodeError(f"音声ストリームが見つかりません：\n{path}")
+    stream = info["streams"][0]
+    duration = info.get("format", {}).get("duration")
+    return int(stream["sample_rate"]), int(stream["channels"]), float(duration) if duration else None
+
+def build_decode_command(path, sample_rate, channels, start=None, duration=None):
+    """音声を16bit PCMで標準出力（pipe:1）へ書き出すffmpegコマンドを作成"""
+    command = [FFMPEG_BIN, "-v", "error", "-nostdin"]
+    if start:
+        command += ["-ss", str(start)]
+    if duration is not None:
+        command += ["-t", str(duration)]
+    command += ["-i", path, "-map", "0:a:0", "-vn",
+                "-f", "s16le", "-acodec", "pcm_s16le", "-ac", str(channels), "-ar", str(sample_rate),
+                "pipe:1"]
+    return command
+
+def decode_audio(path, sample_rate=None, channels=None, start=None, duration=None):
+    """音声・動画ファイルの音声を一時ファイルなしでNumPy配列に読み込む
+
+    sample_rate / channels を指定するとffmpeg側でリサンプリング・ダウンミックスする（省略時は元のまま）。
+    start / duration（秒）で範囲を切り出せる。MP4などの動画コンテナにも対応。
+    戻り値: wavfile.read と同じく (サンプリングレート, int16配列)。モノラルは1次元、それ以外は (サンプル数, チャンネル数)
+    """
+    if sample_rate is None or channels is None:
+        source_rate, source_channels, _ = probe_audio(path)
+        sample_rate = sample_rate or source_rate
+        channels = channels or source_channels
+
+    result = subprocess.run(build_decode_command(path, sample_rate, channels, start, duration),
+                            capture_output=True)
+    if result.returncode != 0:
+        raise AudioDecodeError(f"ffmpegエラー：\n{result.stderr.decode(errors='replace')}")
+
+    data = np.frombuffer(result.stdout, dtype="<i2")
+    if channels > 1:
+        data = data[:len(data) - len(data) % channels].reshape(-1, channels)
+    return sample_rate, data
+
+def read_pcm_blocks(stream, channels=1, block_frames=480000):
+    """16bit PCM（s16le）のストリームを block_frames フレームずつ NumPy 配列として読み込むジェネレーター"""
+    frame_bytes = 2 * channels
+    while True:
+        raw = stream.read(block_frames * frame_bytes)
+        if not raw:
+            break
+        data = np.frombuffer(raw[:len(raw) - len(raw) % frame_bytes], dtype="<i2")
+        yield data if channels == 1 else data.reshape(-1, channels)
+
+def iter_decode_blocks(path, sample_rate, channels=1, block_frames=480000, start=None, duration=None):
+    """ffmpegのパイプ出力を block_frames フレームずつ読み込むジェネレーター（使用メモリは1ブロック分のみ）"""
+    process = subprocess.Popen(build_decode_command(path, sample_rate, channels, start, duration),
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        yield from read_pcm_blocks(process.stdout, channels, block_frames)
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise AudioDecodeError(f"ffmpegエラー：\n{stderr.decode(errors='replace')}")
+    finally:
+        # 途中で読み込みを止めた場合もffmpegを終了させる
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+def iter_wav_blocks(path, block_frames=480000):
+    """WAVファイルをメモリマップで開き、最初のチャンネルを block_frames フレームずつ返すジェネレーター"""
+    from scipy.io import wavfile
+
+    _, data = wavfile.read(path, mmap=True)
+    for begin in range(0, len(data), block_frames):
+        block = data[begin:begin + block_frames]
+        if block.ndim > 1:
+            block = block[:, 0]  # ステレオの場合は最初のチャンネルを使用
+        yield np.array(block)  # メモリマップから1ブロック分だけコピー
+
+def open_audio_blocks(path, block_seconds=10.0):
+    """音声をモノラルでブロックごとに読み込む準備をする
+
+    WAVはメモリマップ、それ以外（MP3や動画ファイルなど）はffmpegのパイプで読み込む。
+    戻り値: (サンプリングレート, 総サンプル数（不明なら None）, ブロックのイテレーター)
+    """
+    if path.lower().endswith(".wav"):
+        from scipy.io import wavfile
+
+        try:
+            sample_rate, data = wavfile.read(path, mmap=True)
+            total_samples = len(data)
+            del data
+            block_frames = max(1, int(block_seconds * sample_rate))
+            return sample_rate, total_samples, iter_wav_blocks(path, block_frames)
+        except ValueError:
+            pass  # メモリマップできない形式（圧縮WAVなど）はffmpegで読み込む
+
+    sample_rate, _, duration = probe_audio(path)
+    total_samples = int(duration * sample_rate) if duration else None
+    block_frames = max(1, int(block_seconds * sample_rate))
+    return sample_rate, total_samples, iter_decode_blocks(path, sample_rate, channels=1, block_frames=block_frames)
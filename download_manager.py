@@ -0,0 +1,369 @@
+import os
+import sys
+import time
+import shutil
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from ffmpeg_runner import FFmpegCancelled
+
+# ダウンロードの状態と表示名
+DOWNLOAD_STATUS = {
+    "pending": "待機中",
+    "downloading": "ダウンロード中",
+    "trimming": "切り出し中",
+    "done": "完了",
+    "failed": "失敗",
+    "cancelled": "中止",
+}
+
+# 同時にダウンロードする件数（既定値）
+DEFAULT_WORKERS = 3
+
+# ffmpegの既定の配置場所（見つからなければ PATH から探す）
+FFMPEG_DIR = r'C:\ffmpeg\bin'
+
+# 進捗を通知する最小の間隔（秒）。progress_hook はデータを受け取るたびに呼ばれるため間引く
+UPDATE_INTERVAL = 0.25
+
+# 切り出し後も元の拡張子のまま保存する音声ファイル（それ以外は MP4 で保存する）
+AUDIO_EXTENSIONS = (".mp3", ".m4a", ".aac", ".opus", ".ogg", ".wav")
+
+class DownloadCancelled(Exception):
+    """ダウンロードが中止されたときの例外"""
+
+class DownloadItem:
+    """ダウンロード1件（URLと時間指定、状態と進捗）
+
+    start / end: 切り出す範囲[秒]。None なら先頭から／最後まで
+    """
+
+    def __init__(self, index, url, start=None, end=None):
+        self.index = index
+        self.url = url
+        self.start = start
+        self.end = end
+        self.status = "pending"
+        self.progress = 0.0
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.speed = None
+        self.title = None
+        self.duration = None
+        self.path = None
+        self.temp_path = None
+        self.error = None
+        self._last_update = 0.0
+
+    @property
+    def has_range(self):
+        return bool(self.start) or self.end is not None
+
+    def needs_trim(self, duration=None):
+        """切り出しが必要か（先頭から最後まで（end >= duration）を指定した場合は不要）"""
+        if self.start:
+            return True
+        return self.end is not None and (not duration or self.end < duration)
+
+    def __repr__(self):
+        return f"DownloadItem({self.index}, {self.url}, {self.status})"
+
+# 一括ダウンロードの結果
+# done / failed / cancelled: 各状態の DownloadItem のリスト, seconds: 全体の処理時間[秒]
+DownloadSummary = namedtuple("DownloadSummary", ["done", "failed", "cancelled", "seconds"])
+
+def parse_time_text(text):
+    """秒数、または「MM:SS」「HH:MM:SS」形式の時刻（秒は小数も可）を秒に変換"""
+    seconds = 0.0
+    for part in text.strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def parse_time_range(start_text, end_text):
+    """開始・終了の文字列（秒、MM:SS、HH:MM:SS）を (開始, 終了) 秒に変換
+
+    空欄は None。終了が 0 以下（未入力の「00:00」など）の場合は最後までとする。
+    """
+    start = parse_time_text(start_text) if start_text and start_text.strip() else None
+    end = parse_time_text(end_text) if end_text and end_text.strip() else None
+    if end is not None and end <= 0:
+        end = None
+    if start is not None and end is not None and start >= end:
+        raise ValueError(f"開始時間は終了時間より前である必要があります: {start_text} - {end_text}")
+    return start, end
+
+def parse_download_list(text):
+    """1行に1件「URL [開始] [終了]」（空白またはカンマ区切り）のリストから DownloadItem のリストを作成
+
+    空行と「#」で始まる行は無視する。
+    """
+    items = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = line.replace(",", " ").split()
+        if len(fields) > 3:
+            raise ValueError(f"{number}行目の形式が正しくありません: {line}")
+        fields += [""] * (3 - len(fields))
+        try:
+            start, end = parse_time_range(fields[1], fields[2])
+        except ValueError as e:
+            raise ValueError(f"{number}行目: {e}") from None
+        items.append(DownloadItem(len(items), fields[0], start, end))
+    return items
+
+def find_ffmpeg(ffmpeg_dir=FFMPEG_DIR):
+    """ffmpegの実行ファイルのパスを返す（見つからなければ None）
+
+    ffmpeg_dir で見つかった場合は PATH の先頭に追加する（切り出しに使う ffmpeg / ffprobe もここから探される）。
+    """
+    for name in ("ffmpeg.exe", "ffmpeg"):
+        path = os.path.join(ffmpeg_dir, name)
+        if os.path.exists(path):
+            os.environ["PATH"] = os.pathsep.join([ffmpeg_dir, os.environ.get("PATH", "")])
+            return path
+    return shutil.which("ffmpeg")
+
+def build_ydl_options(download_dir, download_type="video", ffmpeg_exe=None):
+    """yt-dlp のオプションを作成（download_type: "video"（MP4）/ "audio"（MP3、ffmpegがあれば変換））"""
+    options = {
+        # 同じ動画を複数の範囲で並列にダウンロードしても衝突しないよう、リストの番号を付ける
+        'outtmpl': os.path.join(download_dir, '%(title)s_%(download_index)02d.%(ext)s'),
+        'quiet': True,
+        'no_warnings': True,
+    }
+    if ffmpeg_exe:
+        options['ffmpeg_location'] = os.path.dirname(ffmpeg_exe) or ffmpeg_exe
+    if download_type == "audio":
+        options['format'] = 'bestaudio/best'
+        if ffmpeg_exe:
+            options['postprocessors'] = [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '192',
+            }]
+    else:
+        options['format'] = 'best[ext=mp4]/best'  # 単一フォーマットを指定
+    return options
+
+def trim_download(path, start=None, end=None, on_progress=None, cancel=None, duration=None):
+    """ダウンロードしたファイルの start〜end 秒だけを切り出して置き換え、切り出したファイルのパスを返す
+
+    トリマーと同じ video_cut.trim_media のスマートカットで切り出す（音声のみのファイルは無劣化コピー、
+    スマートカットに対応しないコーデックの動画は再エンコード）。音声はそのままの拡張子、動画は MP4 で保存する。
+    duration: 元のファイルの長さ[秒]（end が None の場合に使う。不明なら ffprobe で調べる）
+    """
+    import ffmpeg
+    from video_cut import trim_media
+
+    start = start or 0.0
+    base, ext = os.path.splitext(path)
+    output_path = path if ext.lower() in AUDIO_EXTENSIONS else f"{base}.mp4"
+    temp_path = f"{base}.trimming{os.path.splitext(output_path)[1]}"
+    if end is None:
+        end = duration or float(ffmpeg.probe(path)['format']['duration'])
+
+    trim_media(path, temp_path, start, end, mode="smart", cancel=cancel, on_progress=on_progress)
+    os.replace(temp_path, output_path)
+    if os.path.abspath(path) != os.path.abspath(output_path):
+        os.remove(path)
+    return output_path
+
+def downloaded_path(info, fallback=None):
+    """extract_info の結果から、後処理（MP3変換など）まで終わったファイルのパスを返す"""
+    for download in reversed((info or {}).get('requested_downloads') or []):
+        if download.get('filepath'):
+            return download['filepath']
+    return (info or {}).get('filepath') or fallback
+
+class DownloadManager:
+    """複数のURLを上限つきのスレッドプールで並列にダウンロードする
+
+    各ワーカーのスレッドは設定済みの YoutubeDL を1つずつ作成して使い回す。
+    progress_hook の通知はスレッドごとの「処理中の DownloadItem」に反映する。
+    時間指定がある場合は、ダウンロード後に trim_download で切り出す（先頭から最後までの指定なら切り出さない）。
+    ydl_options: yt-dlp のオプション（build_ydl_options を参照）
+    on_update: DownloadItem の状態・進捗が変わるたびに呼ばれる関数（ワーカーのスレッドから呼ばれる）
+    ffmpeg_exe: find_ffmpeg で見つけたffmpeg（切り出しは PATH の ffmpeg を使う）。None なら時間指定は無視する
+    ydl_factory: オプションの辞書から YoutubeDL を作る関数（既定: yt_dlp.YoutubeDL）
+    """
+
+    def __init__(self, items, ydl_options, workers=DEFAULT_WORKERS, on_update=None, ffmpeg_exe=None,
+                 ydl_factory=None):
+        self.items = list(items)
+        self.ydl_options = dict(ydl_options)
+        self.workers = max(1, workers or DEFAULT_WORKERS)
+        self.on_update = on_update
+        self.ffmpeg_exe = ffmpeg_exe
+        self.ydl_factory = ydl_factory
+        self._cancel = threading.Event()
+        self._local = threading.local()
+        self._instances = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_urls(cls, urls, ydl_options, **kwargs):
+        """URLのリスト（時間指定なし）からマネージャーを作成"""
+        return cls([DownloadItem(index, url) for index, url in enumerate(urls)], ydl_options, **kwargs)
+
+    def cancel(self):
+        """未実行のダウンロードを中止し、実行中のダウンロードと切り出しも止める"""
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _update(self, item, status=None, error=None, force=True):
+        if status is not None:
+            item.status = status
+            item.error = error
+            if status == "done":
+                item.progress = 100.0
+        now = time.monotonic()
+        if not force and now - item._last_update < UPDATE_INTERVAL:
+            return
+        item._last_update = now
+        if self.on_update is not None:
+            self.on_update(item)
+
+    def _ydl(self):
+        """このスレッドの YoutubeDL（最初の呼び出しで作成し、以降は使い回す）"""
+        ydl = getattr(self._local, "ydl", None)
+        if ydl is None:
+            factory = self.ydl_factory
+            if factory is None:
+                import yt_dlp
+                factory = yt_dlp.YoutubeDL
+            options = dict(self.ydl_options)
+            options['progress_hooks'] = list(options.get('progress_hooks', [])) + [self.progress_hook]
+            ydl = factory(options)
+            self._local.ydl = ydl
+            with self._lock:
+                self._instances.append(ydl)
+        return ydl
+
+    def progress_hook(self, d):
+        """yt-dlp の progress_hook（処理中のスレッドの DownloadItem を更新する）"""
+        item = getattr(self._local, "item", None)
+        if item is None:
+            return
+        if d['status'] == 'downloading':
+            item.temp_path = d.get('tmpfilename') or item.temp_path
+        if self.cancelled:
+            raise DownloadCancelled()
+        if d['status'] == 'downloading':
+            item.downloaded_bytes = d.get('downloaded_bytes') or 0
+            item.total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate') or item.total_bytes
+            item.speed = d.get('speed')
+            if item.total_bytes:
+                item.progress = min(item.downloaded_bytes / item.total_bytes * 100, 100.0)
+            self._update(item, force=False)
+        elif d['status'] == 'finished':
+            item.path = d.get('filename') or item.path
+            item.progress = 100.0
+            self._update(item)
+
+    def _trim_progress(self, item, progress):
+        if progress.percent is not None:
+            item.progress = progress.percent
+        self._update(item)
+
+    def _run_item(self, item):
+        if self.cancelled:
+            self._update(item, "cancelled")
+            return
+        self._local.item = item
+        self._update(item, "downloading")
+        try:
+            # download_index は出力ファイル名（build_ydl_options の outtmpl）に使う
+            info = self._ydl().extract_info(item.url, download=True, extra_info={'download_index': item.index + 1})
+            item.title = (info or {}).get('title')
+            item.duration = (info or {}).get('duration')
+            item.path = downloaded_path(info, item.path)
+            if self.cancelled:
+                raise DownloadCancelled()
+            if self.ffmpeg_exe and item.path and item.needs_trim(item.duration):
+                item.progress = 0.0
+                self._update(item, "trimming")
+                item.path = trim_download(item.path, item.start, item.end,
+                                          on_progress=lambda progress: self._trim_progress(item, progress),
+                                          cancel=self._cancel, duration=item.duration)
+            self._update(item, "done")
+        except (DownloadCancelled, FFmpegCancelled):
+            self._cancelled(item)
+        except Exception as e:
+            # yt-dlp は progress_hook の例外を DownloadError に包むことがあるため、中止の判定はフラグで行う
+            if self.cancelled:
+                self._cancelled(item)
+            elif isinstance(getattr(e, 'stderr', None), bytes) and e.stderr:
+                self._update(item, "failed", e.stderr.decode(errors="replace"))
+            else:
+                self._update(item, "failed", str(e))
+        finally:
+            self._local.item = None
+
+    def _cancelled(self, item):
+        # 途中までのダウンロード（.part）を削除する
+        if item.temp_path and os.path.exists(item.temp_path):
+            try:
+                os.remove(item.temp_path)
+            except OSError:
+                pass
+        self._update(item, "cancelled")
+
+    def run(self):
+        """全てのURLをダウンロードし、DownloadSummary を返す（中止した場合も実行中の処理の終了を待ってから返す）"""
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.workers, max(len(self.items), 1))) as executor:
+                for future in [executor.submit(self._run_item, item) for item in self.items]:
+                    future.result()
+        finally:
+            for ydl in self._instances:
+                ydl.close()
+            self._instances = []
+
+        by_status = {status: [item for item in self.items if item.status == status] for status in DOWNLOAD_STATUS}
+        return DownloadSummary(by_status["done"], by_status["failed"], by_status["cancelled"],
+                               time.perf_counter() - started)
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="複数のURLを並列にダウンロードします（ローカルのHTTPサーバーのURLも指定できます）")
+    parser.add_argument("urls", nargs="*", help="ダウンロードするURL")
+    parser.add_argument("-f", "--file", help="URLのリスト（1行に1件「URL [開始] [終了]」）")
+    parser.add_argument("-o", "--output-dir", default=".", help="保存先（既定: カレントフォルダ）")
+    parser.add_argument("--audio", action="store_true", help="音声のみ（MP3）でダウンロード")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_WORKERS,
+                        help=f"同時にダウンロードする件数（既定: {DEFAULT_WORKERS}）")
+    args = parser.parse_args(argv)
+
+    items = [DownloadItem(index, url) for index, url in enumerate(args.urls)]
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            for item in parse_download_list(f.read()):
+                item.index = len(items)
+                items.append(item)
+    if not items:
+        print("ダウンロードするURLがありません")
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    ffmpeg_exe = find_ffmpeg()
+    options = build_ydl_options(args.output_dir, "audio" if args.audio else "video", ffmpeg_exe)
+
+    def report(item):
+        if item.status in ("done", "failed", "cancelled"):
+            detail = item.path if item.status == "done" else (item.error or "")
+            print(f"[{DOWNLOAD_STATUS[item.status]}] {item.url} {detail}".rstrip())
+
+    summary = DownloadManager(items, options, workers=args.jobs, on_update=report, ffmpeg_exe=ffmpeg_exe).run()
+    print(f"完了: {len(summary.done)}件, 失敗: {len(summary.failed)}件, 中止: {len(summary.cancelled)}件"
+          f"（{summary.seconds:.2f}秒）")
+    return 1 if summary.failed or summary.cancelled else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import os
+import time
+import threading
+import subprocess
+from collections import namedtuple
+
+# ffmpegの実行ファイル（PATHから探す）
+FFMPEG_BIN = "ffmpeg"
+
+# 進捗の通知
+# percent: 進捗（0〜100、長さが不明なら None）, out_time: 出力済みの長さ[秒], speed: 処理速度（再生速度に対する倍率）,
+# eta: 残り時間の目安[秒]（不明なら None）, done: 完了したかどうか
+FFmpegProgress = namedtuple("FFmpegProgress", ["percent", "out_time", "speed", "eta", "done"])
+
+class FFmpegCancelled(Exception):
+    """ffmpegの実行が中止されたときの例外"""
+
+class FFmpegError(Exception):
+    """ffmpegが異常終了したときの例外（stderr にffmpegのエラー出力を持つ）"""
+
+    def __init__(self, message, stderr=b""):
+        super().__init__(message)
+        self.stderr = stderr
+
+def parse_progress_line(line, state):
+    """-progress の出力1行（key=value）を state の辞書に反映し、1回分の報告が揃ったら True を返す"""
+    key, sep, value = line.strip().partition("=")
+    if not sep:
+        return False
+    if key in ("out_time_us", "out_time_ms"):
+        # どちらもマイクロ秒（out_time_ms は歴史的な理由で単位がマイクロ秒）
+        if value.strip().lstrip("-").isdigit():
+            state["out_time"] = max(0, int(value)) / 1e6
+    elif key == "speed":
+        try:
+            state["speed"] = float(value.strip().rstrip("x"))
+        except ValueError:
+            state["speed"] = None
+    elif key == "progress":
+        state["done"] = value.strip() == "end"
+        return True
+    return False
+
+class FFmpegRunner:
+    """ffmpegを非同期に実行し、-progress の出力から進捗を通知する
+
+    command: ffmpeg-python のストリーム（ffmpeg.output(...) など）、または ffmpeg に渡す引数のリスト
+             （先頭の実行ファイル名は含めない）
+    duration: 出力の長さ[秒]（進捗率と残り時間の計算に使う）
+    on_progress: FFmpegProgress を受け取る関数（読み取り用のスレッドから min_interval 秒に1回まで呼ばれる）
+    cancel: threading.Event。セットされたらffmpegを終了させ、cleanup_paths の途中までの出力を削除する
+    pipe_stdout: True なら標準出力をパイプにする（process.stdout から読む）
+    ffmpeg_bin: ffmpegの実行ファイル（ダウンローダーのように場所を指定する場合）
+    """
+
+    def __init__(self, command, duration=None, on_progress=None, cancel=None, cleanup_paths=(),
+                 pipe_stdout=False, ffmpeg_bin=None, min_interval=0.25):
+        self.command = command
+        self.duration = duration
+        self.on_progress = on_progress
+        self.cancel = cancel or threading.Event()
+        self.cleanup_paths = list(cleanup_paths)
+        self.pipe_stdout = pipe_stdout
+        self.ffmpeg_bin = ffmpeg_bin or FFMPEG_BIN
+        self.min_interval = min_interval
+        self.process = None
+        self._messages = []
+        self._reader = None
+        self._last_report = 0.0
+
+    def build_args(self):
+        """実行するコマンドライン（-progress を標準エラーへ出力し、通常の統計表示は止める）"""
+        if isinstance(self.command, (list, tuple)):
+            args = list(self.command)
+        else:
+            import ffmpeg
+            args = ffmpeg.compile(self.command, overwrite_output=True)[1:]
+        return [self.ffmpeg_bin, "-progress", "pipe:2", "-nostats"] + args
+
+    def start(self):
+        """ffmpegを起動して Popen を返す"""
+        self.process = subprocess.Popen(self.build_args(), stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.PIPE if self.pipe_stdout else subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE)
+        self._reader = threading.Thread(target=self._read_progress, daemon=True)
+        self._reader.start()
+        return self.process
+
+    def _read_progress(self):
+        state = {"out_time": 0.0, "speed": None, "done": False}
+        for raw in iter(self.process.stderr.readline, b""):
+            line = raw.decode(errors="replace")
+            if "=" not in line or " " in line.split("=", 1)[0]:
+                self._messages.append(line)  # 進捗以外の行（エラーメッセージなど）
+                continue
+            if parse_progress_line(line, state):
+                self._report(state)
+
+    def _report(self, state):
+        if self.on_progress is None:
+            return
+        now = time.monotonic()
+        if not state["done"] and now - self._last_report < self.min_interval:
+            return
+        self._last_report = now
+        out_time, speed = state["out_time"], state["speed"]
+        percent = eta = None
+        if self.duration:
+            percent = 100.0 if state["done"] else min(out_time / self.duration * 100, 100.0)
+            if speed:
+                eta = max(self.duration - out_time, 0.0) / speed
+        self.on_progress(FFmpegProgress(percent, out_time, speed, 0.0 if state["done"] else eta, state["done"]))
+
+    def wait(self, poll_sec=0.1):
+        """終了を待つ（中止されたら FFmpegCancelled、異常終了なら FFmpegError）"""
+        try:
+            while self.process.poll() is None:
+                if self.cancel.wait(poll_sec):
+                    self.kill()
+                    raise FFmpegCancelled()
+            self._reader.join()
+        finally:
+            if self.process.poll() is None:
+                self.kill()
+        if self.process.returncode != 0:
+            self.remove_outputs()
+            stderr = "".join(self._messages).encode()
+            raise FFmpegError(f"ffmpegエラー（終了コード {self.process.returncode}）：\n{stderr.decode()}", stderr)
+
+    def kill(self):
+        """ffmpegを終了させ、途中までの出力ファイルを削除する"""
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.remove_outputs()
+
+    def remove_outputs(self):
+        """cleanup_paths の（途中までの）出力ファイルを削除する"""
+        for path in self.cleanup_paths:
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def run(self):
+        """起動して終了まで待つ"""
+        self.start()
+        self.wait()
+
+def tk_callback(root, callback):
+    """別スレッドからの通知を Tk のメインループで callback に渡す関数を返す（通知は root.after 経由）"""
+    return lambda *args: root.after(0, callback, *args)
@@ -0,0 +1,83 @@
+import os
+import ffmpeg
+from audio_io import probe_audio, read_pcm_blocks
+from audio_analysis import iter_analyze_blocks, AnalysisStreamWriter
+from note_mapping import midi_to_note_names
+from ffmpeg_runner import FFmpegRunner, FFmpegError
+from video_cut import has_video, run_ffmpeg, TrimCancelled
+
+def build_fused_outputs(input_path, start, end, video_path=None, audio_path=None, analysis_rate=None):
+    """1回のデコードから複数の出力を作るffmpegの出力ノードを作成
+
+    video_path: 切り出した動画（H.264 / AAC）, audio_path: 切り出した音声（MP3）,
+    analysis_rate: 指定すると解析用のモノラル16bit PCMを標準出力（pipe:）へ書き出す
+    """
+    source = ffmpeg.input(input_path, ss=start, t=end - start)
+    outputs = []
+    if video_path:
+        outputs.append(ffmpeg.output(source, video_path, acodec='aac', vcodec='libx264', loglevel='error'))
+    if audio_path:
+        outputs.append(ffmpeg.output(source.audio, audio_path, acodec='libmp3lame', loglevel='error'))
+    if analysis_rate:
+        outputs.append(ffmpeg.output(source.audio, 'pipe:', format='s16le', acodec='pcm_s16le',
+                                     ac=1, ar=analysis_rate, loglevel='error'))
+    return outputs
+
+def trim_extract_analyze(input_path, start, end, video_path=None, audio_path=None, analysis_path=None,
+                         method="peak", block_seconds=10.0, progress=None, cancel=None):
+    """元のファイルの start〜end 秒を1回だけデコードし、動画・音声の切り出しと音声解析を同時に行う
+
+    解析には圧縮前のPCMをメモリ上で直接渡すため、MP3や一時WAVを経由せず、MP3の劣化の影響も受けない。
+    解析結果の時刻は切り出した区間の先頭を 0 とする（切り出したファイルを解析した場合と同じ）。
+    映像のないファイルでは video_path は無視する。
+    progress: 解析の進捗（0〜100）を受け取る関数
+    cancel: threading.Event。セットされるとffmpegを終了させ、途中までの出力を削除して TrimCancelled を送出する
+    戻り値: 実際に書き出したファイルのパスの辞書（"video" / "audio" / "analysis"）
+    """
+    if video_path and not has_video(ffmpeg.probe(input_path)):
+        video_path = None
+    written = {"video": video_path, "audio": audio_path, "analysis": analysis_path}
+    media_paths = [path for path in (video_path, audio_path) if path]
+
+    if not analysis_path:
+        # 解析しない場合は ffmpeg の進捗（出力済みの長さ）をそのまま進捗とする
+        on_progress = None
+        if progress is not None:
+            on_progress = lambda p: progress(p.percent) if p.percent is not None else None
+        run_ffmpeg(ffmpeg.merge_outputs(*build_fused_outputs(input_path, start, end, video_path, audio_path)),
+                   cancel, on_progress, end - start, media_paths)
+        return written
+
+    # 解析は元のサンプリングレートのまま行う
+    sample_rate, _, _ = probe_audio(input_path)
+    outputs = build_fused_outputs(input_path, start, end, video_path, audio_path, analysis_rate=sample_rate)
+    runner = FFmpegRunner(ffmpeg.merge_outputs(*outputs), duration=end - start, cancel=cancel,
+                          cleanup_paths=media_paths, pipe_stdout=True)
+    process = runner.start()
+    completed = False
+    try:
+        blocks = read_pcm_blocks(process.stdout, channels=1, block_frames=max(1, int(block_seconds * sample_rate)))
+        results = iter_analyze_blocks(blocks, sample_rate, total_samples=int((end - start) * sample_rate),
+                                      progress=progress, method=method)
+        with AnalysisStreamWriter(analysis_path) as writer:
+            for result in results:
+                if cancel is not None and cancel.is_set():
+                    runner.kill()
+                    raise TrimCancelled()
+                note_international, note_doremi = midi_to_note_names(result["midi"])
+                writer.write(result["time_ms"], result["frequency"], result["amplitude"],
+                             note_international, note_doremi)
+        runner.wait()
+        completed = True
+    except FFmpegError as e:
+        raise ffmpeg.Error('ffmpeg', b'', e.stderr)
+    finally:
+        if process.poll() is None:
+            runner.kill()
+        process.stdout.close()
+        if not completed:
+            # 中止・解析エラー・ffmpegの異常終了のいずれでも、途中までの動画・音声・解析結果を残さない
+            runner.remove_outputs()
+            if os.path.exists(analysis_path):
+                os.remove(analysis_path)
+    return written
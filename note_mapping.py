@@ -0,0 +1,79 @@
+import numpy as np
+from functools import lru_cache
+
+# 12音の音名（C始まり）
+NOTES_INTERNATIONAL = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+NOTES_DOREMI = ['ド', 'ド#', 'レ', 'レ#', 'ミ', 'ファ', 'ファ#', 'ソ', 'ソ#', 'ラ', 'ラ#', 'シ']
+
+# 音階と半音差のマッピング（基準: A=0）
+NOTE_SEMITONE = {name: index - 9 for index, name in enumerate(NOTES_INTERNATIONAL)}
+
+# 基準周波数
+A4_FREQ = 440
+A4_MIDI = 69
+BASE_C4 = 261.63  # C4 (ド)の周波数
+
+# 純正律の音階（ド〜上のド）と周波数比
+SCALE_NOTES = ['ド', 'レ', 'ミ', 'ファ', 'ソ', 'ラ', 'シ', 'ド']
+JUST_RATIOS = [1.0, 9/8, 5/4, 4/3, 3/2, 5/3, 15/8, 2.0]
+DOREMI_TO_INTERNATIONAL = {
+    'ド': 'C',
+    'レ': 'D',
+    'ミ': 'E',
+    'ファ': 'F',
+    'ソ': 'G',
+    'ラ': 'A',
+    'シ': 'B'
+}
+
+# MIDIノート番号 → 音名の対応表（オクターブ -1〜10、文字列は1回だけ生成して使い回す）
+_MIDI_TABLE_SIZE = 12 * 12
+_INTERNATIONAL_TABLE = np.array(
+    [f"{NOTES_INTERNATIONAL[m % 12]}{m // 12 - 1}" for m in range(_MIDI_TABLE_SIZE)], dtype=object)
+_DOREMI_TABLE = np.array(
+    [f"{NOTES_DOREMI[m % 12]}{m // 12 - 1}" for m in range(_MIDI_TABLE_SIZE)], dtype=object)
+
+def frequencies_to_midi(freqs):
+    """周波数の配列をMIDIノート番号の配列に一括変換（A4=440Hz=69、0Hz以下は -1）"""
+    freqs = np.asarray(freqs, dtype=np.float64)
+    valid = freqs > 0
+    steps = np.round(12 * np.log2(np.where(valid, freqs, A4_FREQ) / A4_FREQ))
+    return np.where(valid, steps + A4_MIDI, -1).astype(np.int64)
+
+def midi_to_note_names(midi, silent="無音"):
+    """MIDIノート番号の配列を (国際式, ドレミ式) の音名配列に変換（-1 は silent）"""
+    midi = np.asarray(midi, dtype=np.int64)
+    in_table = (midi >= 0) & (midi < _MIDI_TABLE_SIZE)
+    index = np.where(in_table, midi, 0)
+    international = _INTERNATIONAL_TABLE[index]
+    doremi = _DOREMI_TABLE[index]
+
+    # 対応表の範囲外（極端な高音・低音）だけは個別に生成
+    for i in np.flatnonzero(~in_table & (midi >= 0)):
+        m = int(midi[i])
+        international[i] = f"{NOTES_INTERNATIONAL[m % 12]}{m // 12 - 1}"
+        doremi[i] = f"{NOTES_DOREMI[m % 12]}{m // 12 - 1}"
+    international[midi < 0] = silent
+    doremi[midi < 0] = silent
+    return international, doremi
+
+def frequencies_to_notes(freqs, silent="無音"):
+    """周波数の配列を (国際式, ドレミ式) の音名配列に一括変換"""
+    return midi_to_note_names(frequencies_to_midi(freqs), silent=silent)
+
+def frequency_to_note(freq):
+    """周波数を音階に変換（国際式とドレミ式）"""
+    international, doremi = frequencies_to_notes([freq])
+    return international[0], doremi[0]
+
+@lru_cache(maxsize=None)
+def parse_note(note, default_octave=4):
+    """音名（例: "C#5", "A"）を (音名, オクターブ) に分解（結果はキャッシュされる）"""
+    letter = note[:2] if len(note) > 1 and note[1] == '#' else note[:1]
+    octave = int(note[len(letter):]) if len(note) > len(letter) else default_octave
+    return letter, octave
+
+def note_to_semitone(note):
+    """音名をA4からの半音数に変換（例: "A4" -> 0, "C5" -> 3）"""
+    letter, octave = parse_note(note)
+    return NOTE_SEMITONE[letter] + 12 * (octave - 4)
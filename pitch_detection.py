@@ -0,0 +1,133 @@
+import time
+from collections import namedtuple
+import numpy as np
+from scipy.fft import rfft, irfft, next_fast_len
+
+# 基本周波数の探索範囲（既定値、警笛の基本音がおさまる範囲）
+F0_MIN = 100.0
+F0_MAX = 2000.0
+
+# YINの閾値（正規化差分関数がこれを下回る最初の谷を周期とする）
+YIN_THRESHOLD = 0.15
+
+# estimate_f0 の結果
+# frequency: 推定した基本周波数（Hz、推定できなければ 0.0）, confidence: 信頼度（0〜1）,
+# frames: 実際に解析したフレーム数, seconds: 処理時間[秒]
+PitchEstimate = namedtuple("PitchEstimate", ["frequency", "confidence", "frames", "seconds"])
+
+def yin_window_size(sample_rate, fmin=F0_MIN):
+    """fmin まで検出するのに必要な最小の窓長（最大周期の2倍）"""
+    return 2 * int(np.ceil(sample_rate / fmin)) + 1
+
+def yin_frames(frames, sample_rate, fmin=F0_MIN, fmax=F0_MAX, threshold=YIN_THRESHOLD):
+    """フレーム行列の各行の基本周波数をYINで一括推定し、(周波数, 信頼度) の配列を返す
+
+    差分関数は rFFT による自己相関と累積和から全フレーム分をまとめて求める。
+    frames: (フレーム数, 窓長) の配列。窓長が最大周期の2倍に満たない場合は探索範囲を縮める
+    戻り値: 周波数（Hz、周期が見つからないフレームは 0.0）と信頼度（1 - 正規化差分、0〜1）
+    """
+    frames = np.asarray(frames, dtype=np.float32)
+    n_frames, window_size = frames.shape
+    tau_min = max(1, int(sample_rate / fmax))
+    tau_max = min(int(np.ceil(sample_rate / fmin)), window_size // 2)
+    if n_frames == 0 or tau_max <= tau_min + 1:
+        return np.zeros(n_frames), np.zeros(n_frames)
+    width = window_size - tau_max  # 差分をとる区間の長さ
+
+    # d(τ) = Σ x[j]^2 + Σ x[j+τ]^2 - 2 Σ x[j]x[j+τ]（j = 0〜width-1）
+    n_fft = next_fast_len(window_size + width)
+    head = rfft(frames[:, :width], n=n_fft, axis=1, workers=-1)
+    full = rfft(frames, n=n_fft, axis=1, workers=-1)
+    correlation = irfft(np.conj(head) * full, n=n_fft, axis=1, workers=-1)[:, :tau_max + 1]
+    energy = np.concatenate([np.zeros((n_frames, 1), dtype=np.float64),
+                             np.cumsum(np.square(frames, dtype=np.float64), axis=1)], axis=1)
+    taus = np.arange(tau_max + 1)
+    shifted_energy = energy[:, taus + width] - energy[:, taus]
+    difference = np.maximum(shifted_energy[:, :1] + shifted_energy - 2 * correlation, 0.0)
+
+    # 累積平均で正規化した差分関数 d'(τ) = d(τ) * τ / Σ_{k=1..τ} d(k)（d'(0) = 1）
+    cumulative = np.cumsum(difference[:, 1:], axis=1)
+    normalized = np.ones_like(difference)
+    np.divide(difference[:, 1:] * taus[1:], cumulative, out=normalized[:, 1:], where=cumulative > 0)
+
+    # 閾値を下回る最初の τ から谷の底まで進む（閾値を下回らなければ無声とする）
+    search = normalized[:, tau_min:tau_max + 1]
+    below = search < threshold
+    voiced = below.any(axis=1)
+    first = np.argmax(below, axis=1)
+    rising = np.concatenate([search[:, 1:] >= search[:, :-1], np.ones((n_frames, 1), dtype=bool)], axis=1)
+    index = np.arange(search.shape[1])
+    valley = np.argmax(rising & (index >= first[:, None]), axis=1)
+
+    # 放物線補間で周期を小数精度に補正
+    rows = np.arange(n_frames)
+    left = search[rows, np.maximum(valley - 1, 0)]
+    center = search[rows, valley]
+    right = search[rows, np.minimum(valley + 1, search.shape[1] - 1)]
+    curvature = left - 2 * center + right
+    offset = np.zeros(n_frames)
+    np.divide(left - right, 2 * curvature, out=offset, where=curvature > 0)
+    period = tau_min + valley + np.clip(offset, -0.5, 0.5)
+
+    frequency = np.where(voiced, sample_rate / period, 0.0)
+    confidence = np.where(voiced, np.clip(1.0 - center, 0.0, 1.0), 0.0)
+    return frequency, confidence
+
+def estimate_f0(data, sample_rate, fmin=F0_MIN, fmax=F0_MAX, segment_sec=1.0, budget_sec=0.1,
+                threshold=YIN_THRESHOLD, batch_frames=16):
+    """音声全体の基本周波数を処理時間の上限つきで推定する
+
+    録音の中で最も強い segment_sec 秒だけを、fmax の4倍程度までデシメーションしてからYINで解析する。
+    フレームはエネルギーの大きい順に batch_frames ずつ解析し、budget_sec を超えたら打ち切る
+    （最初のバッチは必ず解析する）。そのため処理時間は録音の長さにほぼ依存しない。
+    戻り値: PitchEstimate（周波数は有声フレームの信頼度による加重中央値、
+            信頼度は有声フレームの平均信頼度 × 有声フレームの割合）
+    """
+    from scipy.signal import decimate
+    from audio_analysis import find_loudest_segments, frame_signal
+
+    started = time.perf_counter()
+    data = np.asarray(data, dtype=np.float32)
+    if data.ndim > 1:
+        data = data[:, 0]
+
+    # 最も強い区間を切り出す
+    segment_length = min(len(data), int(segment_sec * sample_rate))
+    found = find_loudest_segments(data, segment_length, top_k=1)
+    start = found[0][0] if found else 0
+    segment = data[start:start + segment_length]
+
+    # fmax の4倍程度までデシメーション（高調波を残しつつ計算量を減らす）
+    factor = max(1, int(sample_rate // (4 * fmax)))
+    if factor > 1 and len(segment) > 27 * factor:
+        segment = decimate(segment, factor, ftype="fir", zero_phase=True).astype(np.float32)
+    rate = sample_rate / factor
+
+    window_size = yin_window_size(rate, fmin)
+    frames = frame_signal(segment, window_size, window_size // 2)
+    if len(frames) == 0:
+        return PitchEstimate(0.0, 0.0, 0, time.perf_counter() - started)
+
+    # エネルギーの大きいフレームから解析する
+    order = np.argsort(-np.einsum("ij,ij->i", frames, frames), kind="stable")
+    frequency = np.empty(0)
+    confidence = np.empty(0)
+    for begin in range(0, len(order), batch_frames):
+        batch = frames[np.sort(order[begin:begin + batch_frames])]
+        f, c = yin_frames(batch, rate, fmin, fmax, threshold)
+        frequency = np.concatenate([frequency, f])
+        confidence = np.concatenate([confidence, c])
+        if time.perf_counter() - started > budget_sec:
+            break
+
+    voiced = frequency > 0
+    if not voiced.any():
+        return PitchEstimate(0.0, 0.0, len(frequency), time.perf_counter() - started)
+
+    # 信頼度で重み付けした中央値
+    f, w = frequency[voiced], confidence[voiced]
+    order = np.argsort(f)
+    cumulative = np.cumsum(w[order])
+    f0 = float(f[order][np.searchsorted(cumulative, cumulative[-1] / 2)])
+    score = float(w.mean() * voiced.mean())
+    return PitchEstimate(f0, score, len(frequency), time.perf_counter() - started)
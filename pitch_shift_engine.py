@@ -0,0 +1,46 @@
+import numpy as np
+import librosa
+
+class PitchShifter:
+    """1つの音声のSTFT（振幅と位相のフレーム）を1回だけ計算し、任意のピッチの音を何度でも合成する
+
+    処理内容は librosa.effects.pitch_shift と同じ（位相ボコーダーで時間伸縮 → リサンプリングで元の長さへ）だが、
+    STFTの計算を全てのシフト量で共有する。
+    data: (サンプル数,) または (サンプル数, チャンネル数) の float 配列
+    """
+
+    def __init__(self, data, sample_rate, n_fft=2048, hop_length=None, res_type="soxr_hq"):
+        data = np.asarray(data, dtype=np.float32)
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.hop_length = hop_length or n_fft // 4
+        self.res_type = res_type
+        self.length = data.shape[0]
+        self.multichannel = data.ndim > 1
+        # librosa は (チャンネル数, サンプル数) の並びを扱う
+        self.stft = librosa.stft(data.T if self.multichannel else data, n_fft=n_fft, hop_length=self.hop_length)
+
+    def shift(self, n_steps):
+        """n_steps 半音（小数可）シフトした音声を元と同じ長さ・形状で返す"""
+        if n_steps == 0:
+            stretched = self.stft
+            rate = 1.0
+        else:
+            rate = 2.0 ** (-n_steps / 12)
+            stretched = librosa.phase_vocoder(self.stft, rate=rate, hop_length=self.hop_length, n_fft=self.n_fft)
+
+        y = librosa.istft(stretched, hop_length=self.hop_length, n_fft=self.n_fft,
+                          length=int(round(self.length / rate)), dtype=np.float32)
+        if rate != 1.0:
+            y = librosa.resample(y, orig_sr=float(self.sample_rate) / rate, target_sr=self.sample_rate,
+                                 res_type=self.res_type)
+        y = librosa.util.fix_length(y, size=self.length)
+        return y.T if self.multichannel else y
+
+    def shift_cents(self, cents):
+        """セント単位でシフトした音声を返す"""
+        return self.shift(cents / 100)
+
+    def shift_many(self, n_steps_list):
+        """複数のシフト量（半音）に対する結果をリストで返す"""
+        return [self.shift(n_steps) for n_steps in n_steps_list]
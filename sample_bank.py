@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from note_mapping import NOTES_INTERNATIONAL, A4_FREQ, A4_MIDI
+
+# 生成アルゴリズムのバージョン（処理内容を変えたら上げて、古いキャッシュを使わないようにする）
+BANK_VERSION = 1
+
+# バンクの目録ファイル名（作曲ツールはこのファイルがあるフォルダを生成済みバンクとして読み込む）
+MANIFEST_NAME = "bank.json"
+
+# キャッシュの保存先（既定）
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".whistle_sample_banks")
+
+def chromatic_targets(octaves):
+    """指定オクターブの全12半音の (音名, 周波数) のリスト（例: ("C#5", 554.37)）"""
+    targets = []
+    for octave in octaves:
+        for index, name in enumerate(NOTES_INTERNATIONAL):
+            midi = 12 * (octave + 1) + index
+            targets.append((f"{name}{octave}", A4_FREQ * 2 ** ((midi - A4_MIDI) / 12)))
+    return targets
+
+def bank_cache_key(data, sample_rate, segment_start, segment_length, n_steps_list, params):
+    """元の音声・セグメント位置・シフト量・アルゴリズムのバージョンから決まるキャッシュキー（SHA-256）"""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(data, dtype=np.float32).tobytes())
+    digest.update(json.dumps({
+        "version": BANK_VERSION,
+        "sample_rate": sample_rate,
+        "segment_start": int(segment_start),
+        "segment_length": int(segment_length),
+        "n_steps": [round(float(n), 6) for n in n_steps_list],
+        "params": params,
+    }, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+def build_sample_bank(source_path, octaves=(4, 5), note_duration=10.0, fade_time=0.3,
+                      cache_dir=None, workers=None, verbose=True):
+    """警笛の録音1つから全12半音×指定オクターブの音階ファイル（例: C#5.wav）を生成し、バンクのフォルダを返す
+
+    結果は cache_dir/<キャッシュキー>/ に保存され、同じ録音・同じ設定で再実行した場合は何もせずに返す。
+    """
+    # 生成済みバンクを読み込むだけの作曲ツールが librosa などを読み込まずに済むよう、ここで読み込む
+    from scipy.io import wavfile
+    from whistle_scale_core import (load_whistle, estimate_base_frequency, extract_best_segment,
+                                    render_sustained_note, iter_shifted_degrees)
+
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    sample_rate, data = load_whistle(source_path)
+    base_freq = estimate_base_frequency(data, sample_rate).frequency
+    segment_start, segment = extract_best_segment(data, sample_rate)
+
+    targets = chromatic_targets(octaves)
+    n_steps_list = [12 * np.log2(freq / base_freq) for _, freq in targets]
+    params = {"note_duration": note_duration, "fade_time": fade_time, "engine": "stft"}
+    key = bank_cache_key(data, sample_rate, segment_start, len(segment), n_steps_list, params)
+    bank_dir = os.path.join(cache_dir, key[:16])
+
+    if os.path.exists(os.path.join(bank_dir, MANIFEST_NAME)):
+        if verbose:
+            print(f"生成済みのバンクを使用します: {bank_dir}")
+        return bank_dir
+
+    if verbose:
+        print(f"バンクを生成中... 検出周波数: {base_freq:.1f}Hz, 音数: {len(targets)}")
+    started = time.perf_counter()
+    target_length = int(note_duration * sample_rate)
+    fade_samples = int(fade_time * sample_rate)
+
+    # 一時フォルダに書き出してから名前を変更し、途中で失敗したバンクがキャッシュに残らないようにする
+    os.makedirs(cache_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=f"{key[:16]}_", dir=cache_dir)
+    try:
+        notes = {}
+        for index, shifted_segment, seconds in iter_shifted_degrees(segment, sample_rate, n_steps_list,
+                                                                    workers=workers):
+            name = targets[index][0]
+            filename = f"{name}.wav"
+            wavfile.write(os.path.join(work_dir, filename), sample_rate,
+                          render_sustained_note(shifted_segment, target_length, fade_samples))
+            notes[name] = filename
+            if verbose:
+                print(f"  {name}: {targets[index][1]:.1f}Hz（ピッチシフト {seconds:.2f}秒）")
+
+        manifest = {
+            "version": BANK_VERSION,
+            "key": key,
+            "source": os.path.abspath(source_path),
+            "sample_rate": sample_rate,
+            "base_freq": float(base_freq),
+            "segment_start": int(segment_start),
+            "octaves": list(octaves),
+            "params": params,
+            "notes": {name: notes[name] for name, _ in targets},
+        }
+        with open(os.path.join(work_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        try:
+            os.replace(work_dir, bank_dir)
+        except OSError:
+            # 同じバンクを別のプロセスが先に作成した場合はそちらを使う
+            shutil.rmtree(work_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+    if verbose:
+        print(f"バンクを生成しました: {bank_dir}（{time.perf_counter() - started:.2f}秒）")
+    return bank_dir
+
+def load_manifest(bank_dir):
+    """バンクの目録を読み込む（生成済みバンクでなければ None）"""
+    path = os.path.join(bank_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="警笛の録音から全12半音の音階ファイル（サンプルバンク）を生成します")
+    parser.add_argument("source", help="警笛の録音ファイル（WAV/MP3/M4Aなど）")
+    parser.add_argument("--octaves", type=int, nargs="+", default=[4, 5], help="生成するオクターブ（既定: 4 5）")
+    parser.add_argument("--duration", type=float, default=10.0, help="各音の長さ(秒)（既定: 10.0）")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help=f"キャッシュの保存先（既定: {DEFAULT_CACHE_DIR}）")
+    parser.add_argument("-j", "--workers", type=int, help="ピッチシフトの並列数（既定: CPUコア数）")
+    parser.add_argument("-q", "--quiet", action="store_true", help="進捗を表示しない")
+    args = parser.parse_args(argv)
+
+    bank_dir = build_sample_bank(args.source, octaves=args.octaves, note_duration=args.duration,
+                                 cache_dir=args.cache_dir, workers=args.workers, verbose=not args.quiet)
+    print(bank_dir)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,52 +1,79 @@
-import pandas as pd
 import os
 import re
-from tkinter import Tk, filedialog
-from pydub import AudioSegment
+import glob
+import sys
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import math
-
-# 音階と半音差のマッピング（基準: A=0）
-NOTE_SEMITONE = {
-    "C": -9, "C#": -8, "D": -7, "D#": -6,
-    "E": -5, "F": -4, "F#": -3, "G": -2,
-    "G#": -1, "A": 0, "A#": 1, "B": 2
-}
+from collections import OrderedDict, namedtuple
+from note_mapping import NOTE_SEMITONE, A4_MIDI, note_to_semitone, midi_to_note_names
+from sustain_engine import SustainLoop, CROSSFADE_SEC
 
 def get_semitone_distance(base_note, target_note):
-    """半音距離を計算"""
-    # base_noteの解析
-    if '#' in base_note:
-        base_letter = base_note[:2]  # 例: "C#4" -> "C#"
-        base_octave = int(base_note[2:])  # 例: "C#4" -> 4
-    else:
-        base_letter = base_note[0]  # 例: "C4" -> "C"
-        base_octave = int(base_note[1:])  # 例: "C4" -> 4
-    
-    # target_noteの解析
-    if len(target_note) == 1:
-        # 例: "C" -> "C", 4
-        target_letter, target_octave = target_note, 4
-    elif len(target_note) == 2 and target_note[1] == '#':
-        # 例: "C#" -> "C#", 4
-        target_letter, target_octave = target_note, 4
-    elif '#' in target_note:
-        # 例: "C#4" -> "C#", 4
-        target_letter = target_note[:2]
-        target_octave = int(target_note[2:])
-    else:
-        # 例: "C4" -> "C", 4
-        target_letter = target_note[0]
-        target_octave = int(target_note[1:])
+    """半音距離を計算（例: "C4" -> "C#5" は 13、オクターブ省略時は4）"""
+    return note_to_semitone(target_note) - note_to_semitone(base_note)
+
+# 楽譜（Excel）を列ごとにまとめた音符イベント表
+# start_ms/end_ms: 開始・終了時刻(ms), base_note: 基本音階（シャープなし）, semitone_diff: 基本音階オクターブ4からの半音差,
+# note: 正規化した音階文字列, target_note: 楽譜に書かれた音高の音名（例: "C#5"、オクターブ省略時は4。
+# E# や B# など実在しない音名は空文字）, valid: 合成対象かどうか
+NoteEvents = namedtuple("NoteEvents", ["start_ms", "end_ms", "base_note", "semitone_diff", "note", "target_note", "valid"])
+
+def build_event_table(df, last_note_ms=500):
+    """DataFrame全体をベクトル演算で解析し、ミキサーが直接使える音符イベント表を作成"""
+    import pandas as pd
+
+    # 「hh:mm:ss:fff」形式のミリ秒部分（fff）だけピリオドに変換してミリ秒に変換
+    times = df["時刻(hh:mm:ss:fff)"].astype(str).str.replace(r"(?<=\d{2}:\d{2}:\d{2}):", ".", regex=True)
+    start = (pd.to_timedelta(times, errors="coerce").dt.total_seconds() * 1000).to_numpy(dtype=np.float64)
+
+    # 各行の終了時刻は次の行の開始時刻（最終行は開始+last_note_ms）
+    end = np.append(start[1:], start[-1] + last_note_ms) if len(start) else start
+    timed = ~(np.isnan(start) | np.isnan(end))
+    start_ms = np.where(timed, start, 0).astype(np.int64)
+    end_ms = np.where(timed, end, 0).astype(np.int64)
+
+    # 音階文字列を一括で解析（例: "C#5" -> "C#", "5"、オクターブがなければ4を仮定）
+    notes = df["音階（国際式）"].where(df["音階（国際式）"].notna(), "").astype(str).str.upper().str.strip()
+    parts = notes.str.extract(r"^([A-G]#?)([0-9]?)")
+    note_name = parts[0].fillna("")
+    octave = pd.to_numeric(parts[1], errors="coerce").fillna(4).to_numpy(dtype=np.int64)
+    base_note = note_name.str[:1].to_numpy(dtype=object)
+
+    # 楽譜の音高（MIDIノート番号、parse_note と同じ解釈）を1回だけ求める。E# / B# など実在しない音名は除外
+    semitone = note_name.map(NOTE_SEMITONE)
+    known = semitone.notna().to_numpy()
+    written_midi = A4_MIDI + semitone.fillna(0).to_numpy(dtype=np.int64) + 12 * (octave - 4)
+
+    # get_semitone_distance(基本音階+"4", 目標音階) と同じ（PitchBank は基本音をオクターブ4として扱う）
+    base_semitone = pd.Series(base_note).map(NOTE_SEMITONE).fillna(0).to_numpy(dtype=np.int64)
+    semitone_diff = np.where(known, written_midi - (A4_MIDI + base_semitone), 0).astype(np.int16)
+
+    # PrebuiltBank はこの音名のファイルを使うため、どちらのバンクでも同じ楽譜は同じ音高になる
+    target_note = np.where(known, midi_to_note_names(written_midi)[0], "")
 
-    semitone_base = NOTE_SEMITONE[base_letter] + 12 * base_octave
-    semitone_target = NOTE_SEMITONE[target_letter] + 12 * target_octave
-    return semitone_target - semitone_base
+    valid = timed & known & (end_ms > start_ms)
+    return NoteEvents(start_ms, end_ms, base_note, semitone_diff, notes.to_numpy(dtype=object),
+                      target_note.astype(object), valid)
 
-def change_pitch(sound, semitone_diff):
-    """ピッチ変更（改良版）"""
+def change_pitch(sound, semitone_diff, method="resample", shifter=None):
+    """ピッチ変更（改良版）
+
+    method="resample": サンプリングレートの変更でピッチを変える（高速だが音の長さも変わる）
+    method="stft": 共通のSTFTピッチシフトエンジンで長さを変えずにピッチだけを変える。
+                   同じ音を何度もシフトする場合は解析済みの shifter（PitchShifter）を渡す
+    """
     if semitone_diff == 0:
         return sound
     
+    if method == "stft":
+        if shifter is None:
+            from pitch_shift_engine import PitchShifter
+            shifter = PitchShifter(segment_to_array(sound), sound.frame_rate)
+        return array_to_segment(shifter.shift(semitone_diff), sound.frame_rate, normalize=False)
+    
     # 音程変更の倍率を計算
     pitch_ratio = 2.0 ** (semitone_diff / 12.0)
     
@@ -59,159 +86,617 @@ def change_pitch(sound, semitone_diff):
     # 元のサンプリングレートに戻す（ピッチは変更されたまま）
     return pitched_sound.set_frame_rate(sound.frame_rate)
 
-# GUIでファイル選択
-root = Tk()
-root.withdraw()
-
-# 音階ファイル選択
-paths = filedialog.askopenfilenames(title="音階ファイル（例：C4.wav, A5.wavなど）を選択")
-note_files_raw = {}
-
-print("選択されたファイル:")
-for path in paths:
-    filename = os.path.splitext(os.path.basename(path))[0].upper()
-    print(f"  ファイル名: {filename}")
-    match = re.match(r"^([A-G]#?)[0-9]$", filename)
-    if match:
-        note_letter = match.group(1)
-        print(f"    抽出された音階: {note_letter}")
-        if note_letter not in note_files_raw:
-            note_files_raw[note_letter] = path
+def segment_to_array(sound):
+    """AudioSegmentを float32 の (フレーム数, チャンネル数) 配列に変換（-1.0〜1.0）"""
+    samples = np.array(sound.get_array_of_samples(), dtype=np.float32)
+    full_scale = float(1 << (8 * sound.sample_width - 1))
+    return (samples / full_scale).reshape(-1, sound.channels)
+
+def array_to_segment(data, frame_rate, headroom=0.1, normalize=True):
+    """float32 配列を（normalize=True ならピーク正規化して）16bit PCMのAudioSegmentに変換"""
+    from pydub import AudioSegment
+
+    # AudioSegment.normalize() と同じく、ピークを -headroom dBFS に揃える
+    peak = float(np.max(np.abs(data))) if data.size and normalize else 0.0
+    if peak > 0:
+        data = data * (10 ** (-headroom / 20) / peak)
+    pcm = np.clip(np.round(data * 32767), -32768, 32767).astype(np.int16)
+    return AudioSegment(pcm.tobytes(), frame_rate=frame_rate, sample_width=2, channels=data.shape[1])
+
+def mix_into(buffer, samples, start_frame):
+    """ミキシングバッファに音声をその場で加算（はみ出した部分は切り捨て）し、書き込んだ終端フレームを返す"""
+    end_frame = min(start_frame + len(samples), len(buffer))
+    if end_frame > start_frame:
+        buffer[start_frame:end_frame] += samples[:end_frame - start_frame]
+    return max(end_frame, start_frame)
+
+class PitchBank:
+    """ピッチ変更済みの音声をキャッシュするバンク（LRU方式で上限件数を超えたら古いものから破棄）
+
+    キーは (基本音階, 半音差)。基本音階と半音差は楽譜の音高（音名とオクターブ）から
+    一意に決まるため、同じ音高は最初の1回だけリサンプリングされる。
+    基本音のファイルはファイル名のオクターブにかかわらずオクターブ4の音として扱う（例: "C5" は C の基本音を+12半音）。
+    method="stft" の場合は基本音階ごとにSTFTを1回だけ計算し、全ての半音差で共有する。
+    """
+
+    def __init__(self, note_files, max_entries=64, method="resample"):
+        self.note_files = note_files
+        self.method = method
+        self._shifters = {}
+        # 全音階ファイルは同じサンプリングレート・チャンネル数に揃えてあることが前提
+        first = next(iter(note_files.values()))
+        self.frame_rate = first.frame_rate
+        self.channels = first.channels
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._loops = {}  # キャッシュと同じキーの SustainLoop（キャッシュから破棄されたら一緒に破棄）
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.record_stats = True  # False の間はヒット・ミスを数えない（2パス合成の2回目など）
+
+    def get(self, base_note_name, semitone_diff):
+        """ピッチ変更済みの float32 配列を返す（キャッシュになければ作成して登録）"""
+        key = (base_note_name, semitone_diff)
+        samples = self._cache.get(key)
+        if samples is not None:
+            self._cache.move_to_end(key)
+            self.hits += self.record_stats
+            return samples
+
+        self.misses += self.record_stats
+        if self.method == "stft" and semitone_diff != 0:
+            samples = self._shifter(base_note_name).shift(semitone_diff).astype(np.float32)
         else:
-            print(f"    {note_letter} は既に存在するためスキップ")
-    else:
-        print(f"    マッチしませんでした（正規表現: ^([A-G]#?)[0-9]$）")
+            samples = segment_to_array(change_pitch(self.note_files[base_note_name], semitone_diff))
+        samples.setflags(write=False)  # 共有バッファなので書き換えを禁止
+        self._cache[key] = samples
+        if len(self._cache) > self.max_entries:
+            evicted, _ = self._cache.popitem(last=False)
+            self._loops.pop(evicted, None)
+            self.evictions += self.record_stats
+        return samples
 
-print(f"\n音階ファイル辞書の内容: {note_files_raw}")
+    def available(self, events):
+        """基本音が読み込まれているイベントかどうかの配列を返す"""
+        return np.isin(events.base_note, list(self.note_files.keys()))
 
-note_files = {}
-for k, v in note_files_raw.items():
-    try:
-        audio = AudioSegment.from_wav(v)
-        note_files[k] = audio
-        print(f"  {k}: 読み込み成功 - {len(audio)}ms, {audio.frame_rate}Hz, {audio.channels}ch")
-    except Exception as e:
-        print(f"  {k}: 読み込み失敗 - {e}")
+    def missing_messages(self, events, missing):
+        """available でないイベント（missing）を報告するメッセージのリスト"""
+        return [f"{name} の基本音が読み込まれていません。スキップ。" for name in sorted(set(events.base_note[missing]))]
 
-available_notes = list(note_files.keys())
-print("読み込んだ音階:", available_notes)
+    def lookup(self, events, i):
+        """i 行目のイベントの音声を返す"""
+        return self.get(events.base_note[i], int(events.semitone_diff[i]))
 
-# 必要な音階（A〜G#）があるか確認
-required_notes = ["A", "B", "C", "D", "E", "F", "G"]
-missing = [note for note in required_notes if note not in note_files]
-if missing:
-    raise Exception(f"次の音階ファイルが足りません: {', '.join(missing)}")
+    def sustain_loop(self, events, i, samples):
+        """i 行目のイベントの音声（lookup の戻り値 samples）を伸ばすためのループを返す"""
+        key = (events.base_note[i], int(events.semitone_diff[i]))
+        loop = self._loops.get(key)
+        if loop is None:
+            loop = SustainLoop(samples, int(CROSSFADE_SEC * self.frame_rate))
+            if key in self._cache:
+                self._loops[key] = loop
+        return loop
 
-# Excel読み込み
-excel_path = filedialog.askopenfilename(title="Excelファイルを選択")
-df = pd.read_excel(excel_path)
-output_dir = os.path.dirname(excel_path)
+    def _shifter(self, base_note_name):
+        """基本音階の解析済みピッチシフター（STFTは基本音階ごとに1回だけ計算）"""
+        shifter = self._shifters.get(base_note_name)
+        if shifter is None:
+            from pitch_shift_engine import PitchShifter
+            shifter = PitchShifter(segment_to_array(self.note_files[base_note_name]), self.frame_rate)
+            self._shifters[base_note_name] = shifter
+        return shifter
 
-# 「hh:mm:ss:fff」形式のミリ秒部分（fff）だけピリオドに変換
-df["時刻修正"] = df["時刻(hh:mm:ss:fff)"].str.replace(r"(?<=\d{2}:\d{2}:\d{2}):", ".", regex=True)
+    def stats(self):
+        """キャッシュの利用状況を返す"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._cache),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
 
-# 正しく変換された文字列を使ってミリ秒に変換
-df["ms"] = pd.to_timedelta(df["時刻修正"]).dt.total_seconds() * 1000
+class PrebuiltBank:
+    """生成済みのサンプルバンク（sample_bank.py で作成した全12半音×オクターブの音階ファイル）
 
-# 音声合成
-output = AudioSegment.silent(duration=0)
-print(f"\n音声合成を開始します。データ行数: {len(df)}")
+    全ての音高がファイルとして用意されているため、作曲時にピッチ変更の計算は行わない。
+    PitchBank と同じ available / lookup / stats を持つ。キーは楽譜の音高（NoteEvents.target_note、例: "C#5"）で、
+    オクターブ4の基本音を使う PitchBank と同じ音高になる。
+    """
 
-for i in range(len(df)):
-    start_ms = int(df.iloc[i]["ms"])
-    end_ms = int(df.iloc[i + 1]["ms"]) if i < len(df) - 1 else start_ms + 500
-    duration = end_ms - start_ms
-    note_full = df.iloc[i]["音階（国際式）"].upper().strip()
-    
-    print(f"\n行 {i+1}: 音階='{note_full}', 開始={start_ms}ms, 長さ={duration}ms")
+    def __init__(self, note_files):
+        self.note_files = note_files
+        first = next(iter(note_files.values()))
+        self.frame_rate = first.frame_rate
+        self.channels = first.channels
+        self._samples = {}
+        for name, audio in note_files.items():
+            samples = segment_to_array(audio)
+            samples.setflags(write=False)  # 共有バッファなので書き換えを禁止
+            self._samples[name] = samples
+        self._loops = {}
+        self.hits = 0
+        self.misses = 0
+        self.record_stats = True
+
+    def available(self, events):
+        """目標音階のファイルがあるイベントかどうかの配列を返す"""
+        return np.isin(events.target_note, list(self._samples.keys()))
+
+    def missing_messages(self, events, missing):
+        """available でないイベント（missing）を報告するメッセージのリスト"""
+        return [f"{name} の音階ファイルがバンクにありません。スキップ。"
+                for name in sorted(set(events.target_note[missing]))]
+
+    def lookup(self, events, i):
+        """i 行目のイベントの音声を返す"""
+        self.hits += self.record_stats
+        return self._samples[events.target_note[i]]
+
+    def sustain_loop(self, events, i, samples):
+        """i 行目のイベントの音声（lookup の戻り値 samples）を伸ばすためのループを返す"""
+        name = events.target_note[i]
+        loop = self._loops.get(name)
+        if loop is None:
+            loop = self._loops[name] = SustainLoop(samples, int(CROSSFADE_SEC * self.frame_rate))
+        return loop
+
+    def stats(self):
+        """利用状況を返す（全て読み込み済みなので常にヒット）"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": 0,
+            "entries": len(self._samples),
+            "hit_rate": 1.0 if self.hits else 0.0,
+        }
+
+def load_prebuilt_bank(bank_dir, manifest, verbose=True):
+    """生成済みのサンプルバンクを読み込み、ミキシング形式に揃えたPrebuiltBankを返す"""
+    from pydub import AudioSegment
+
+    note_files = {name: AudioSegment.from_wav(os.path.join(bank_dir, filename))
+                  for name, filename in manifest["notes"].items()}
+    frame_rate = max(audio.frame_rate for audio in note_files.values())
+    channels = max(audio.channels for audio in note_files.values())
+    note_files = {k: audio.set_frame_rate(frame_rate).set_channels(channels)
+                  for k, audio in note_files.items()}
+    if verbose:
+        print(f"生成済みのサンプルバンクを読み込みました: {bank_dir}（{len(note_files)}音）")
+    return PrebuiltBank(note_files)
+
+# 出力ファイル名の既定値（楽譜と同じフォルダに保存）
+DEFAULT_OUTPUT_NAME = "romantic_railway_警笛完成版.wav"
+
+# 必要な音階（A〜G）
+REQUIRED_NOTES = ["A", "B", "C", "D", "E", "F", "G"]
+
+def find_note_files(paths, verbose=True):
+    """ファイル名（例：C4.wav, A5.wav）から音階を抽出し、音階→パスの辞書を返す"""
+    note_files_raw = {}
+    if verbose:
+        print("選択されたファイル:")
+    for path in paths:
+        filename = os.path.splitext(os.path.basename(path))[0].upper()
+        match = re.match(r"^([A-G]#?)[0-9]$", filename)
+        if match:
+            note_letter = match.group(1)
+            if note_letter not in note_files_raw:
+                note_files_raw[note_letter] = path
+                if verbose:
+                    print(f"  ファイル名: {filename} -> 音階: {note_letter}")
+            elif verbose:
+                print(f"  ファイル名: {filename} -> {note_letter} は既に存在するためスキップ")
+        elif verbose:
+            print(f"  ファイル名: {filename} -> マッチしませんでした（正規表現: ^([A-G]#?)[0-9]$）")
+    return note_files_raw
 
-    match = re.match(r"([A-G]#?)([0-9]?)", note_full)
-    if not match:
-        print(f"  無効な音階形式: {note_full}")
-        continue
+def load_pitch_bank(note_source, cache_size=64, pitch_method="resample", verbose=True):
+    """音階ファイル（フォルダまたはファイルのリスト）を読み込み、ミキシング形式に揃えたPitchBankを返す
 
-    note_name = match.group(1)
-    note_octave = match.group(2)
-    if note_octave:
-        target_note = note_name + note_octave
+    フォルダに生成済みバンクの目録（bank.json）がある場合は、ピッチ変更を行わない PrebuiltBank を返す。
+    """
+    from pydub import AudioSegment
+
+    if isinstance(note_source, (str, os.PathLike)):
+        note_dir = os.fspath(note_source)
+        from sample_bank import load_manifest
+        manifest = load_manifest(note_dir)
+        if manifest is not None:
+            return load_prebuilt_bank(note_dir, manifest, verbose=verbose)
+        paths = sorted(os.path.join(note_dir, name) for name in os.listdir(note_dir)
+                       if name.lower().endswith(".wav"))
     else:
-        target_note = note_name + "4"  # オクターブがなければ4を仮定
-    
-    print(f"  解析結果: note_name='{note_name}', target_note='{target_note}'")
-    print(f"  利用可能な音階: {list(note_files.keys())}")
-
-    # 基本音階を取得（シャープの場合は元の音階から）
-    if '#' in note_name:
-        base_note_name = note_name[0]  # F# -> F, A# -> A
-        base_sound = note_files.get(base_note_name)
-        if base_sound is None:
-            print(f"  {base_note_name} の基本音が読み込まれていません。スキップ。")
+        paths = list(note_source)
+    note_files_raw = find_note_files(paths, verbose=verbose)
+
+    note_files = {}
+    for k, v in note_files_raw.items():
+        try:
+            audio = AudioSegment.from_wav(v)
+            note_files[k] = audio
+            if verbose:
+                print(f"  {k}: 読み込み成功 - {len(audio)}ms, {audio.frame_rate}Hz, {audio.channels}ch")
+        except Exception as e:
+            print(f"  {k}: 読み込み失敗 - {e}")
+
+    # 必要な音階があるか確認
+    missing = [note for note in REQUIRED_NOTES if note not in note_files]
+    if missing:
+        raise Exception(f"次の音階ファイルが足りません: {', '.join(missing)}")
+
+    # ミキシングバッファの形式（全音階ファイルで最大のサンプリングレート・チャンネル数に揃える）
+    frame_rate = max(audio.frame_rate for audio in note_files.values())
+    channels = max(audio.channels for audio in note_files.values())
+    note_files = {k: audio.set_frame_rate(frame_rate).set_channels(channels)
+                  for k, audio in note_files.items()}
+    if verbose:
+        print("読み込んだ音階:", list(note_files.keys()))
+    return PitchBank(note_files, max_entries=cache_size, method=pitch_method)
+
+def load_score(score_path):
+    """楽譜（解析結果）を読み込む（.xlsx のほか、高速に読める .csv / .parquet にも対応）"""
+    import pandas as pd
+
+    ext = os.path.splitext(score_path)[1].lower()
+    if ext == ".csv":
+        return pd.read_csv(score_path, dtype={"時刻(hh:mm:ss:fff)": str, "音階（国際式）": str})
+    if ext == ".parquet":
+        return pd.read_parquet(score_path, columns=["時刻(hh:mm:ss:fff)", "音階（国際式）"])
+    return pd.read_excel(score_path)
+
+def select_active_events(events, pitch_bank, verbose=True):
+    """合成対象となるイベントの行番号を返す（無効な行・基本音のない音階は除外）"""
+    if verbose:
+        for i in np.flatnonzero(~events.valid):
+            print(f"  行 {i+1}: 無効な行をスキップ（音階='{events.note[i]}', 開始={events.start_ms[i]}ms, 終了={events.end_ms[i]}ms）")
+        # 実在しない音名（E# / B# など）は無効な行として除外されている
+        for note in sorted(set(events.note[(events.base_note != "") & (events.target_note == "")])):
+            print(f"  音階 '{note}' は存在しない音名です。")
+
+    # 基本音（生成済みバンクでは目標音階のファイル）が読み込まれていない音階は除外
+    loaded = pitch_bank.available(events)
+    for message in pitch_bank.missing_messages(events, events.valid & ~loaded):
+        print(f"  {message}")
+    return np.flatnonzero(events.valid & loaded)
+
+def render_events(events, pitch_bank, verbose=True):
+    """イベント表をミキシングバッファに合成し、(バッファ, 有効フレーム数) を返す"""
+    frame_rate, channels = pitch_bank.frame_rate, pitch_bank.channels
+    active = select_active_events(events, pitch_bank, verbose=verbose)
+
+    # イベント表から全体の長さを先に求める
+    total_ms = int(events.end_ms[active].max()) if len(active) else 0
+
+    # float32のミキシングバッファを1回だけ確保し、各音をその場で加算する
+    mix_buffer = np.zeros((total_ms * frame_rate // 1000, channels), dtype=np.float32)
+    mixed_frames = 0
+    if verbose:
+        print(f"\n音声合成を開始します。データ行数: {len(events.valid)}, 合成する音: {len(active)}, バッファ長: {total_ms}ms")
+
+    start_frames = events.start_ms * frame_rate // 1000
+    end_frames = events.end_ms * frame_rate // 1000
+
+    for i in active:
+        try:
+            samples = pitch_bank.lookup(events, i)
+        except Exception as e:
+            print(f"  行 {i+1}: ピッチ調整エラー: {e}")
             continue
-        print(f"  {note_name} を {base_note_name} から計算で作成します")
-    else:
-        base_sound = note_files.get(note_name)
-        if base_sound is None:
-            print(f"  {note_name} の基本音が読み込まれていません。スキップ。")
+        if len(samples) == 0:
+            print(f"  行 {i+1}: 警告: 空の音声をスキップ")
             continue
-        print(f"  {note_name} の基本音を使用します")
 
-    # ピッチ補正：基本音階のオクターブ4から目標音階への変換
-    base_reference = (note_name[0] if '#' in note_name else note_name) + "4"
-    semitone_diff = get_semitone_distance(base_reference, target_note)
-    
-    # シャープの場合は追加で+1半音
-    if '#' in note_name:
-        semitone_diff += 1
-    
-    print(f"  半音差: {semitone_diff} (基準: {base_reference} -> {target_note})")
-    
-    try:
-        adjusted_sound = change_pitch(base_sound, semitone_diff)
-        print(f"  ピッチ調整完了: {len(adjusted_sound)}ms")
-    except Exception as e:
-        print(f"  ピッチ調整エラー: {e}")
-        continue
-
-    # 長さ調整
-    if duration <= 0:
-        print(f"  警告: 無効な長さ {duration}ms をスキップ")
-        continue
-        
-    if len(adjusted_sound) < duration:
-        # 音声を繰り返して必要な長さにする
-        repeats = (duration // len(adjusted_sound)) + 1
-        adjusted_sound = (adjusted_sound * repeats)[:duration]
+        # 長さ調整（ミリ秒境界をフレーム位置に換算）
+        start_frame = int(start_frames[i])
+        length = int(end_frames[i]) - start_frame
+        if len(samples) < length:
+            # 音声をループ（境界はクロスフェード）させて必要な長さにし、バッファへ直接加算
+            end_frame = min(start_frame + length, len(mix_buffer))
+            pitch_bank.sustain_loop(events, i, samples).render(mix_buffer[start_frame:end_frame], add=True)
+            mixed_frames = max(mixed_frames, end_frame, start_frame)
+        else:
+            # 合成（バッファへ直接加算）
+            mixed_frames = max(mixed_frames, mix_into(mix_buffer, samples[:length], start_frame))
+
+    return mix_buffer, mixed_frames
+
+def iter_render_blocks(events, active, pitch_bank, block_frames=48000):
+    """イベントを開始時刻順に固定長ブロックへ合成し、完成したブロックから順に返すジェネレーター
+
+    メモリに保持するのは現在のブロックと、そのブロックにかかっている音だけなので、
+    曲の長さに関係なく使用メモリは一定に収まる。
+    """
+    frame_rate, channels = pitch_bank.frame_rate, pitch_bank.channels
+    start_frames = events.start_ms * frame_rate // 1000
+    end_frames = events.end_ms * frame_rate // 1000
+    order = active[np.argsort(start_frames[active], kind="stable")]
+    total_frames = int(end_frames[order].max()) if len(order) else 0
+
+    next_event = 0
+    sounding = []  # (開始フレーム, 終了フレーム, 音声, ループ) のリスト（ループは音声より長く鳴らす音だけ）
+    for block_start in range(0, total_frames, block_frames):
+        block_end = min(block_start + block_frames, total_frames)
+        block = np.zeros((block_end - block_start, channels), dtype=np.float32)
+
+        # このブロック内で始まる音を追加
+        while next_event < len(order) and start_frames[order[next_event]] < block_end:
+            i = order[next_event]
+            next_event += 1
+            try:
+                samples = pitch_bank.lookup(events, i)
+            except Exception as e:
+                print(f"  行 {i+1}: ピッチ調整エラー: {e}")
+                continue
+            if len(samples) > 0:
+                start, end = int(start_frames[i]), int(end_frames[i])
+                loop = pitch_bank.sustain_loop(events, i, samples) if end - start > len(samples) else None
+                sounding.append((start, end, samples, loop))
+
+        # 鳴っている音をブロックに加算（短い音はループさせる）
+        still_sounding = []
+        for start, end, samples, loop in sounding:
+            lo, hi = max(start, block_start), min(end, block_end)
+            if hi > lo:
+                target = block[lo - block_start:hi - block_start]
+                if loop is None:
+                    target += samples[lo - start:hi - start]
+                else:
+                    loop.render(target, offset=lo - start, add=True)
+            if end > block_end:
+                still_sounding.append((start, end, samples, loop))
+        sounding = still_sounding
+
+        yield block
+
+def write_wav_stream(output_path, make_blocks, frame_rate, channels, headroom=0.1, peak=None):
+    """ブロック単位で16bit PCMのWAVファイルに書き出し、書き込んだフレーム数を返す
+
+    make_blocks はブロックのイテレーターを返す関数。peak を省略した場合は
+    1回目でピークだけを求め、2回目で正規化しながら書き出す（2パス方式）。
+    """
+    if peak is None:
+        peak = 0.0
+        for block in make_blocks():
+            if block.size:
+                peak = max(peak, float(np.max(np.abs(block))))
+    gain = 10 ** (-headroom / 20) / peak if peak > 0 else 1.0
+
+    frames = 0
+    with wave.open(output_path, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(frame_rate)
+        for block in make_blocks():
+            pcm = np.clip(np.round(block * (gain * 32767)), -32768, 32767).astype("<i2")
+            wav.writeframes(pcm.tobytes())
+            frames += len(block)
+    return frames
+
+def compose(note_dir, score_path, output_path=None, *, pitch_bank=None, cache_size=64,
+            pitch_method="resample", last_note_ms=500, headroom=0.1, stream=False, block_ms=1000, peak=None, verbose=True):
+    """音階ファイルと楽譜から曲を合成してWAVに保存する（GUI不要）
+
+    note_dir: 音階ファイルのフォルダ（またはファイルパスのリスト）。pitch_bank を渡した場合は無視される
+    output_path: 省略時は楽譜と同じフォルダに DEFAULT_OUTPUT_NAME で保存
+    pitch_method: "resample"（高速、音の長さも変わる）または "stft"（長さを保ったままピッチだけ変える）
+    stream: True の場合は block_ms ごとのブロックに合成しながらWAVへ直接書き出す（長時間の曲向け）。
+            peak（ミキシング後の最大振幅）を渡すとピーク計算のパスを省略する
+    戻り値: 出力パス・再生時間・イベント数・キャッシュ統計をまとめた辞書
+    """
+    if pitch_bank is None:
+        pitch_bank = load_pitch_bank(note_dir, cache_size=cache_size, pitch_method=pitch_method, verbose=verbose)
+    if output_path is None:
+        output_path = os.path.join(os.path.dirname(os.path.abspath(score_path)), DEFAULT_OUTPUT_NAME)
+
+    # 楽譜全体を列ごとに解析してイベント表を作成
+    df = load_score(score_path)
+    events = build_event_table(df, last_note_ms=last_note_ms)
+
+    if stream:
+        # ストリーミング合成: ブロックごとに合成してWAVへ直接書き出す
+        active = select_active_events(events, pitch_bank, verbose=verbose)
+        if len(active) == 0:
+            raise Exception("音声データが生成されませんでした。")
+        block_frames = max(1, block_ms * pitch_bank.frame_rate // 1000)
+        passes = 0
+
+        def make_blocks():
+            # 2パス方式では全イベントを2回引くため、キャッシュの統計は最初のパスの分だけ数える
+            nonlocal passes
+            pitch_bank.record_stats = passes == 0
+            passes += 1
+            return iter_render_blocks(events, active, pitch_bank, block_frames=block_frames)
+
+        try:
+            mixed_frames = write_wav_stream(output_path, make_blocks, pitch_bank.frame_rate, pitch_bank.channels,
+                                            headroom=headroom, peak=peak)
+        finally:
+            pitch_bank.record_stats = True
     else:
-        adjusted_sound = adjusted_sound[:duration]
-    
-    print(f"  長さ調整完了: {len(adjusted_sound)}ms")
+        mix_buffer, mixed_frames = render_events(events, pitch_bank, verbose=verbose)
+        if mixed_frames == 0:
+            raise Exception("音声データが生成されませんでした。")
+
+        # 音声データの正規化（音量調整）はバッファ全体に対して最後に1回だけ行い、16bit PCM形式で保存
+        output = array_to_segment(mix_buffer[:mixed_frames], pitch_bank.frame_rate, headroom=headroom)
+        output.export(output_path, format="wav", parameters=["-acodec", "pcm_s16le"])
+    duration_ms = mixed_frames * 1000 // pitch_bank.frame_rate
+
+    bank_stats = pitch_bank.stats()
+    if verbose:
+        print(f"合成完了 - 総長: {duration_ms}ms")
+        print(f"\nピッチキャッシュ: ヒット {bank_stats['hits']}回, ミス {bank_stats['misses']}回, "
+              f"破棄 {bank_stats['evictions']}回, ヒット率 {bank_stats['hit_rate']:.1%}")
+        print(f"完成しました！ファイル名: {output_path}")
+        print(f"ファイルサイズ: {os.path.getsize(output_path) / 1024:.1f} KB")
+        print(f"再生時間: {duration_ms / 1000:.2f} 秒")
+
+    return {
+        "output_path": output_path,
+        "duration_ms": duration_ms,
+        "events": int(np.count_nonzero(events.valid)),
+        "cache": bank_stats,
+    }
+
+# バッチ処理のワーカープロセスが共有する音階バンク（プロセス起動時に1回だけ設定）
+_worker_pitch_bank = None
 
-    # 無音追加（必要なら）
-    if start_ms > len(output):
-        silence_duration = start_ms - len(output)
-        output += AudioSegment.silent(duration=silence_duration)
-        print(f"  無音追加: {silence_duration}ms")
+def _init_batch_worker(pitch_bank):
+    """ワーカー初期化: fork時は親プロセスのバンクをそのまま引き継ぎ、spawn時は1回だけ受け取る"""
+    global _worker_pitch_bank
+    _worker_pitch_bank = pitch_bank
 
-    # 合成
+def _compose_worker(score_path, output_path, options):
+    """ワーカープロセスで1つの楽譜を合成し、結果（成功/失敗・処理時間）を返す"""
+    started = time.perf_counter()
     try:
-        output = output.overlay(adjusted_sound, position=start_ms)
-        print(f"  合成完了 - 総長: {len(output)}ms")
+        result = compose(None, score_path, output_path, pitch_bank=_worker_pitch_bank, **options)
+        result.update(score_path=score_path, ok=True, error=None)
     except Exception as e:
-        print(f"  合成エラー: {e}")
-        continue
+        result = {"score_path": score_path, "output_path": output_path, "ok": False, "error": f"{type(e).__name__}: {e}"}
+    result["seconds"] = time.perf_counter() - started
+    return result
 
-# 保存（より安全な形式で）
-output_path = os.path.join(output_dir, "romantic_railway_警笛完成版.wav")
+def expand_score_paths(patterns):
+    """楽譜のパス・globパターンのリストを重複なしのファイル一覧に展開"""
+    score_paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if path not in score_paths:
+                score_paths.append(path)
+    return score_paths
 
-# 音声データの正規化（音量調整）
-if len(output) > 0:
-    # 音量を適切なレベルに調整
-    output = output.normalize()
-    
-    # 16bit PCM形式で保存
-    output.export(output_path, format="wav", parameters=["-acodec", "pcm_s16le"])
-    print(f"完成しました！ファイル名: {output_path}")
-    print(f"ファイルサイズ: {os.path.getsize(output_path) / 1024:.1f} KB")
-    print(f"再生時間: {len(output) / 1000:.2f} 秒")
-else:
-    print("エラー: 音声データが生成されませんでした。")
\ No newline at end of file
+def batch_output_paths(score_paths, output_dir=None):
+    """各楽譜の出力パス（「楽譜名_警笛.wav」）を返す
+
+    output_dir を指定した場合、別のフォルダにある同名の楽譜が同じ出力先にならないよう、
+    重なった楽譜には元のフォルダ名を付け（「フォルダ名_楽譜名_警笛.wav」）、それでも重なれば連番を付ける。
+    """
+    def candidate(score_path, with_folder=False, counter=0):
+        stem = os.path.splitext(os.path.basename(score_path))[0]
+        if with_folder:
+            folder = os.path.basename(os.path.dirname(os.path.abspath(score_path)))
+            stem = f"{folder}_{stem}"
+        if counter:
+            stem = f"{stem}_{counter}"
+        out_dir = output_dir or os.path.dirname(os.path.abspath(score_path))
+        return os.path.join(out_dir, f"{stem}_警笛.wav")
+
+    first_choice = [candidate(score_path) for score_path in score_paths]
+    counts = {}
+    for path in first_choice:
+        key = os.path.normcase(os.path.abspath(path))
+        counts[key] = counts.get(key, 0) + 1
+
+    outputs, used = [], set()
+    for score_path, path in zip(score_paths, first_choice):
+        with_folder = counts[os.path.normcase(os.path.abspath(path))] > 1
+        counter = 0
+        while True:
+            path = candidate(score_path, with_folder, counter)
+            key = os.path.normcase(os.path.abspath(path))
+            if key not in used:
+                break
+            counter += 1
+        used.add(key)
+        outputs.append(path)
+    return outputs
+
+def compose_batch(note_dir, score_patterns, output_dir=None, *, workers=None, cache_size=64,
+                  pitch_method="resample", last_note_ms=500, headroom=0.1, stream=False, block_ms=1000, verbose=True):
+    """複数の楽譜をプロセスプールで並列に合成する
+
+    音階ファイルは親プロセスで1回だけ読み込み、ワーカーへ共有する。
+    出力は output_dir（省略時は各楽譜と同じフォルダ）に「楽譜名_警笛.wav」で保存（同名の楽譜は batch_output_paths を参照）。
+    戻り値: 楽譜ごとの結果（score_path, output_path, ok, error, seconds など）のリスト（入力順）
+    """
+    score_paths = expand_score_paths(score_patterns)
+    if not score_paths:
+        raise Exception("合成する楽譜が見つかりません")
+    pitch_bank = load_pitch_bank(note_dir, cache_size=cache_size, pitch_method=pitch_method, verbose=verbose)
+    options = {"last_note_ms": last_note_ms, "headroom": headroom, "stream": stream,
+               "block_ms": block_ms, "verbose": False}
+
+    jobs = dict(zip(score_paths, batch_output_paths(score_paths, output_dir)))
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(pitch_bank,)) as executor:
+        futures = [executor.submit(_compose_worker, score_path, output_path, options)
+                   for score_path, output_path in jobs.items()]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["score_path"]] = result
+            if verbose:
+                if result["ok"]:
+                    print(f"[成功] {result['score_path']} -> {result['output_path']} ({result['seconds']:.2f}秒)")
+                else:
+                    print(f"[失敗] {result['score_path']}: {result['error']} ({result['seconds']:.2f}秒)")
+
+    ordered = [results[score_path] for score_path in score_paths]
+    if verbose:
+        succeeded = sum(1 for result in ordered if result["ok"])
+        print(f"\nバッチ合成完了: 成功 {succeeded}件, 失敗 {len(ordered) - succeeded}件, "
+              f"合計 {time.perf_counter() - started:.2f}秒")
+    return ordered
+
+def select_files_with_dialog():
+    """GUIで音階ファイルと楽譜を選択（引数なしで起動した場合）"""
+    from tkinter import Tk, filedialog
+
+    root = Tk()
+    root.withdraw()
+    paths = filedialog.askopenfilenames(title="音階ファイル（例：C4.wav, A5.wavなど）を選択")
+    excel_path = filedialog.askopenfilename(
+        title="Excelファイルを選択",
+        filetypes=[("解析結果", "*.xlsx *.csv *.parquet"), ("すべてのファイル", "*.*")])
+    root.destroy()
+    return list(paths), excel_path
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="音階ファイルと解析結果のExcelから警笛の曲を合成します")
+    parser.add_argument("note_dir", nargs="?", help="音階ファイル（C5.wavなど）のフォルダ。省略時はGUIで選択")
+    parser.add_argument("scores", nargs="*", help="楽譜（解析結果の .xlsx / .csv / .parquet）。複数指定やglobパターン（例: '*_analysis*.xlsx'）でバッチ合成")
+    parser.add_argument("-o", "--output", help=f"出力WAVファイル（既定: 楽譜と同じフォルダの {DEFAULT_OUTPUT_NAME}）。バッチ合成時は出力フォルダ")
+    parser.add_argument("-j", "--workers", type=int, help="バッチ合成のワーカープロセス数（既定: CPUコア数）")
+    parser.add_argument("--cache-size", type=int, default=64, help="ピッチキャッシュの上限件数（既定: 64）")
+    parser.add_argument("--pitch-method", choices=["resample", "stft"], default="resample",
+                        help="ピッチ変更の方式（resample: 高速・長さも変わる, stft: 長さを保つ）（既定: resample）")
+    parser.add_argument("--last-note-ms", type=int, default=500, help="最終行の音の長さ(ms)（既定: 500）")
+    parser.add_argument("--headroom", type=float, default=0.1, help="正規化後のピークの余裕(dB)（既定: 0.1）")
+    parser.add_argument("--stream", action="store_true", help="ブロックごとに合成しながらWAVへ書き出す（長時間の曲でもメモリ使用量が一定）")
+    parser.add_argument("--block-ms", type=int, default=1000, help="ストリーミング合成のブロック長(ms)（既定: 1000）")
+    parser.add_argument("-q", "--quiet", action="store_true", help="進捗を表示しない")
+    args = parser.parse_args(argv)
+
+    if args.note_dir is None:
+        note_source, score_path = select_files_with_dialog()
+    elif not args.scores:
+        parser.error("楽譜ファイルを指定してください")
+    elif len(args.scores) > 1 or glob.has_magic(args.scores[0]):
+        results = compose_batch(args.note_dir, args.scores, args.output, workers=args.workers,
+                                cache_size=args.cache_size, pitch_method=args.pitch_method,
+                                last_note_ms=args.last_note_ms,
+                                headroom=args.headroom, stream=args.stream, block_ms=args.block_ms,
+                                verbose=not args.quiet)
+        return 0 if all(result["ok"] for result in results) else 1
+    else:
+        note_source, score_path = args.note_dir, args.scores[0]
+
+    compose(note_source, score_path, args.output, cache_size=args.cache_size,
+            pitch_method=args.pitch_method, last_note_ms=args.last_note_ms, headroom=args.headroom, stream=args.stream,
+            block_ms=args.block_ms, verbose=not args.quiet)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
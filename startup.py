@@ -0,0 +1,28 @@
+import threading
+import importlib
+
+def prewarm_modules(module_names, on_done=None):
+    """重いモジュールをバックグラウンドのスレッドで先に読み込んでおく（画面の表示後に呼び出す）
+
+    読み込みに失敗したモジュールは無視する（実際に使う時点で改めてエラーになる）。
+    on_done: 全て読み込み終わったら (読み込めたモジュール名のリスト) を受け取る関数（別スレッドから呼ばれる）
+    戻り値: 読み込み中のスレッド
+    """
+    def run():
+        loaded = []
+        for name in module_names:
+            try:
+                importlib.import_module(name)
+                loaded.append(name)
+            except Exception:
+                pass
+        if on_done is not None:
+            on_done(loaded)
+
+    thread = threading.Thread(target=run, name="prewarm", daemon=True)
+    thread.start()
+    return thread
+
+def schedule_prewarm(root, module_names, delay_ms=300):
+    """Tkの画面が表示されてから delay_ms 後にバックグラウンドでの先読みを開始する"""
+    root.after(delay_ms, prewarm_modules, module_names)
@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+# 計測するエントリーポイント（モジュール名）
+ENTRY_POINTS = [
+    "sampled_note_composition",
+    "train_whistle_scale_shifter",
+    "video_trimmer_otoari",
+    "video_downloader",
+]
+
+def measure_import(module, repeats=5, python=sys.executable, cwd=None):
+    """新しいPythonプロセスで module を import し、所要時間[秒]のリストを返す（コールドスタートに近い条件）"""
+    code = ("import time; t = time.perf_counter(); import {0}; "
+            "print(time.perf_counter() - t)").format(module)
+    times = []
+    for _ in range(repeats):
+        result = subprocess.run([python, "-c", code], capture_output=True, text=True, cwd=cwd)
+        if result.returncode != 0:
+            raise RuntimeError(f"{module} の読み込みに失敗しました：\n{result.stderr}")
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return times
+
+def heaviest_imports(module, top=10, python=sys.executable, cwd=None):
+    """-X importtime の結果から、読み込みに時間がかかったモジュール (名前, 累積時間[秒]) を上位 top 件返す"""
+    result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=cwd)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = [field.strip() for field in line[len("import time:"):].split("|")]
+        if fields[1].isdigit():
+            entries.append((fields[2].strip(), int(fields[1]) / 1e6))
+    return sorted(entries, key=lambda entry: entry[1], reverse=True)[:top]
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="各ツールの起動時（import）の所要時間を計測します")
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS, help="計測するモジュール（既定: 全ツール）")
+    parser.add_argument("-n", "--repeats", type=int, default=5, help="計測回数（既定: 5）")
+    parser.add_argument("--top", type=int, default=0, help="時間がかかったモジュールを上位N件表示")
+    parser.add_argument("--json", help="結果をJSONファイルに保存（前回との比較用）")
+    args = parser.parse_args(argv)
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    failed = False
+    for module in args.modules:
+        try:
+            times = measure_import(module, args.repeats, cwd=cwd)
+        except RuntimeError as e:
+            print(e)
+            failed = True
+            continue
+        results[module] = {"median": statistics.median(times), "min": min(times), "max": max(times)}
+        print(f"{module:32s} 中央値 {results[module]['median']*1000:8.1f}ms"
+              f"（最小 {results[module]['min']*1000:.1f}ms, 最大 {results[module]['max']*1000:.1f}ms）")
+        for name, seconds in heaviest_imports(module, args.top, cwd=cwd) if args.top else []:
+            print(f"    {name:40s} {seconds*1000:8.1f}ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
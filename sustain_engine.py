@@ -0,0 +1,89 @@
+from functools import lru_cache
+import numpy as np
+
+# ループ境界のクロスフェードの長さ（既定値, 秒）
+CROSSFADE_SEC = 0.01
+
+@lru_cache(maxsize=32)
+def equal_power_fades(length):
+    """長さ length の等パワークロスフェード曲線 (フェードアウト, フェードイン) を返す（cos² + sin² = 1、結果はキャッシュされる）"""
+    phase = (np.arange(length, dtype=np.float64) + 0.5) / length * (np.pi / 2)
+    fade_out = np.cos(phase).astype(np.float32)
+    fade_in = np.sin(phase).astype(np.float32)
+    fade_out.setflags(write=False)
+    fade_in.setflags(write=False)
+    return fade_out, fade_in
+
+def find_loop_points(samples, crossfade, search=None):
+    """ゼロクロス（負→正）の位置に合わせたループ区間 (開始, 終了) を返す
+
+    開始は先頭から search サンプル以内、終了は (末尾 - crossfade) から search サンプル以内で探し、
+    見つからなければ (0, 末尾 - crossfade) を使う。多チャンネルの場合は最初のチャンネルで判定する。
+    """
+    mono = samples if samples.ndim == 1 else samples[:, 0]
+    n = len(mono)
+    loop_start, loop_end = 0, n - crossfade
+    search = n // 8 if search is None else search
+    crossings = np.flatnonzero((mono[:-1] < 0) & (mono[1:] >= 0)) + 1
+
+    head = crossings[crossings <= search]
+    if len(head):
+        loop_start = int(head[0])
+    tail = crossings[(crossings <= n - crossfade) & (crossings >= n - crossfade - search)]
+    if len(tail):
+        loop_end = int(tail[-1])
+    if loop_end - loop_start <= crossfade:
+        return 0, n - crossfade
+    return loop_start, loop_end
+
+class SustainLoop:
+    """短い音声をループさせて任意の長さに伸ばす
+
+    出力は samples[:loop_end] をそのまま鳴らした後、ループ区間 samples[loop_start:loop_end] を繰り返す。
+    各ループの先頭 crossfade サンプルは、元の音声の続き（samples[loop_end:]）をフェードアウトさせながら
+    ループの先頭をフェードインさせる等パワークロスフェードにしてあり、境界でクリック音が出ない。
+    クロスフェード済みのループ区間は最初に1回だけ作成し、出力先にはスライス単位で直接書き込む
+    （繰り返した音声全体を中間配列として作らないため、コストは出力の長さに比例）。
+    """
+
+    def __init__(self, samples, crossfade, loop_points=None, snap_to_zero=True):
+        samples = np.asarray(samples)
+        crossfade = max(0, min(int(crossfade), len(samples) // 2))
+        if loop_points is None:
+            loop_points = find_loop_points(samples, crossfade) if snap_to_zero else (0, len(samples) - crossfade)
+        loop_start, loop_end = loop_points
+        self.samples = samples
+        self.loop_start = loop_start
+        self.loop_end = loop_end
+
+        loop = samples[loop_start:loop_end].astype(np.float32)
+        if crossfade:
+            fade_out, fade_in = equal_power_fades(crossfade)
+            if samples.ndim > 1:
+                fade_out, fade_in = fade_out[:, None], fade_in[:, None]
+            loop[:crossfade] = (samples[loop_end:loop_end + crossfade] * fade_out
+                                + samples[loop_start:loop_start + crossfade] * fade_in)
+        if len(loop) == 0:
+            raise ValueError("ループ区間が空です")
+        loop.setflags(write=False)
+        self.loop = loop
+
+    def render(self, out, offset=0, gain=1.0, add=False):
+        """ループさせた音声の offset サンプル目から len(out) サンプルを out に書き込む（add=True なら加算）"""
+        position, written, total = offset, 0, len(out)
+        while written < total:
+            if position < self.loop_end:
+                source = self.samples[position:min(self.loop_end, position + total - written)]
+            else:
+                phase = (position - self.loop_end) % len(self.loop)
+                source = self.loop[phase:phase + total - written]
+            target = out[written:written + len(source)]
+            if add:
+                target += source if gain == 1.0 else source * gain
+            elif gain == 1.0:
+                target[...] = source
+            else:
+                np.multiply(source, gain, out=target, casting="unsafe")
+            written += len(source)
+            position += len(source)
+        return out
@@ -0,0 +1,201 @@
+import os
+import shutil
+import subprocess
+import threading
+import functools
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+import pytest
+
+import download_manager
+from download_manager import DownloadManager, DownloadItem, build_ydl_options
+
+CHUNK_SIZE = 16 * 1024
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def media_server(tmp_path):
+    """fixture のメディアファイルを配信するローカルのHTTPサーバー（戻り値: (URLの先頭, 配信フォルダ)）"""
+    root = tmp_path / "served"
+    root.mkdir()
+    server = HTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(root)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}", root
+    finally:
+        server.shutdown()
+        server.server_close()
+
+class UrllibYoutubeDL:
+    """テスト用の YoutubeDL（URLのファイルを urllib で保存し、yt-dlp と同じ形式で progress_hooks を呼ぶ）"""
+
+    instances = []
+
+    def __init__(self, params):
+        self.params = params
+        self.closed = False
+        UrllibYoutubeDL.instances.append(self)
+
+    def _hook(self, status):
+        for hook in self.params.get('progress_hooks', []):
+            hook(status)
+
+    def extract_info(self, url, download=True, extra_info=None):
+        title, ext = os.path.splitext(os.path.basename(urlparse(url).path))
+        path = self.params['outtmpl'] % {'title': title, 'ext': ext[1:], **(extra_info or {})}
+        temp_path = path + ".part"
+        with urlopen(url) as response, open(temp_path, "wb") as f:
+            total = int(response.headers['Content-Length'])
+            downloaded = 0
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                downloaded += len(chunk)
+                self._hook({'status': 'downloading', 'downloaded_bytes': downloaded, 'total_bytes': total,
+                            'tmpfilename': temp_path, 'filename': path})
+        os.replace(temp_path, path)
+        self._hook({'status': 'finished', 'filename': path})
+        return {'title': title, 'duration': None, 'requested_downloads': [{'filepath': path}]}
+
+    def close(self):
+        self.closed = True
+
+def record_updates(updates):
+    lock = threading.Lock()
+
+    def on_update(item):
+        with lock:
+            updates.setdefault(item.index, []).append((item.status, item.progress))
+    return on_update
+
+def test_downloads_in_parallel_with_progress(media_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(download_manager, "UPDATE_INTERVAL", 0.0)
+    base_url, root = media_server
+    for index in range(4):
+        (root / f"clip{index}.mp4").write_bytes(os.urandom(CHUNK_SIZE * 4 + index))
+    items = [DownloadItem(index, f"{base_url}/clip{index}.mp4") for index in range(4)]
+    items.append(DownloadItem(4, f"{base_url}/missing.mp4"))
+
+    UrllibYoutubeDL.instances = []
+    updates = {}
+    manager = DownloadManager(items, build_ydl_options(str(tmp_path / "out")), workers=2,
+                              on_update=record_updates(updates), ydl_factory=UrllibYoutubeDL)
+    os.makedirs(tmp_path / "out")
+    summary = manager.run()
+
+    assert [item.index for item in summary.done] == [0, 1, 2, 3]
+    assert [item.index for item in summary.failed] == [4]
+    assert summary.cancelled == []
+
+    # ワーカーごとに1つの YoutubeDL を使い回し、終了時に閉じる
+    assert 1 <= len(UrllibYoutubeDL.instances) <= 2
+    assert all(ydl.closed for ydl in UrllibYoutubeDL.instances)
+
+    for item in summary.done:
+        statuses = [status for status, _ in updates[item.index]]
+        assert statuses[0] == "downloading" and statuses[-1] == "done"
+        progresses = [progress for status, progress in updates[item.index] if status == "downloading"]
+        assert any(0 < progress < 100 for progress in progresses)
+        assert progresses == sorted(progresses)
+        assert updates[item.index][-1][1] == 100.0
+        with open(item.path, "rb") as f:
+            assert f.read() == (root / f"clip{item.index}.mp4").read_bytes()
+    assert updates[4][-1][0] == "failed"
+
+def test_cancel_stops_pending_downloads(media_server, tmp_path):
+    base_url, root = media_server
+    (root / "clip.mp4").write_bytes(os.urandom(CHUNK_SIZE * 8))
+    items = [DownloadItem(index, f"{base_url}/clip.mp4") for index in range(3)]
+    manager = DownloadManager(items, build_ydl_options(str(tmp_path)), workers=1,
+                              ydl_factory=UrllibYoutubeDL)
+    manager.on_update = lambda item: manager.cancel() if item.status == "downloading" else None
+
+    summary = manager.run()
+
+    assert summary.done == []
+    assert len(summary.cancelled) == 3
+    assert not any(name.endswith(".part") for name in os.listdir(tmp_path))
+
+def test_same_url_downloads_to_distinct_files(media_server, tmp_path):
+    base_url, root = media_server
+    (root / "clip.mp4").write_bytes(os.urandom(CHUNK_SIZE * 4))
+    items = [DownloadItem(0, f"{base_url}/clip.mp4", 0, 1), DownloadItem(1, f"{base_url}/clip.mp4", 1, 2)]
+    summary = DownloadManager(items, build_ydl_options(str(tmp_path)), workers=2,
+                              ydl_factory=UrllibYoutubeDL).run()
+
+    assert len(summary.done) == 2
+    assert len({item.path for item in summary.done}) == 2
+    for item in summary.done:
+        with open(item.path, "rb") as f:
+            assert f.read() == (root / "clip.mp4").read_bytes()
+
+def test_full_range_is_not_trimmed():
+    item = DownloadItem(0, "http://127.0.0.1/clip.mp4", 0, 60)
+    assert not item.needs_trim(duration=60)
+    assert item.needs_trim(duration=90)
+    assert DownloadItem(0, "http://127.0.0.1/clip.mp4", 5, None).needs_trim(duration=60)
+    assert not DownloadItem(0, "http://127.0.0.1/clip.mp4").needs_trim(duration=60)
+
+class FixtureYoutubeDL(UrllibYoutubeDL):
+    """fixture.mp4 の長さ（4秒）も返すテスト用の YoutubeDL（yt-dlp の info['duration'] と同じ）"""
+
+    def extract_info(self, url, download=True, extra_info=None):
+        info = super().extract_info(url, download, extra_info)
+        info['duration'] = 4.0
+        return info
+
+def probe_duration(path):
+    import ffmpeg
+    return float(ffmpeg.probe(path)['format']['duration'])
+
+@pytest.mark.skipif(not (shutil.which("ffmpeg") and shutil.which("ffprobe")), reason="ffmpeg が必要")
+def test_trims_downloaded_range(media_server, tmp_path):
+    pytest.importorskip("ffmpeg")
+    base_url, root = media_server
+    subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=duration=4:size=160x120:rate=25",
+                    "-f", "lavfi", "-i", "sine=duration=4", "-c:v", "libx264", "-g", "25", "-c:a", "aac",
+                    "-shortest", str(root / "fixture.mp4")], check=True)
+    updates = {}
+    items = [DownloadItem(0, f"{base_url}/fixture.mp4", 1.0, 3.0),
+             DownloadItem(1, f"{base_url}/fixture.mp4", 0.0, 4.0)]
+    manager = DownloadManager(items[:1], build_ydl_options(str(tmp_path / "a")), on_update=record_updates(updates),
+                              ffmpeg_exe=shutil.which("ffmpeg"), ydl_factory=FixtureYoutubeDL)
+    os.makedirs(tmp_path / "a")
+    summary = manager.run()
+
+    assert [item.index for item in summary.done] == [0]
+    assert "trimming" in [status for status, _ in updates[0]]
+    assert probe_duration(items[0].path) == pytest.approx(2.0, abs=0.2)
+
+    # 先頭から最後までの指定なら切り出さない（ダウンロードしたファイルのまま）
+    os.makedirs(tmp_path / "b")
+    summary = DownloadManager(items[1:], build_ydl_options(str(tmp_path / "b")),
+                              ffmpeg_exe=shutil.which("ffmpeg"), ydl_factory=FixtureYoutubeDL).run()
+    assert [item.index for item in summary.done] == [1]
+    with open(items[1].path, "rb") as f:
+        assert f.read() == (root / "fixture.mp4").read_bytes()
+
+def test_real_youtube_dl_generic_extractor(media_server, tmp_path):
+    pytest.importorskip("yt_dlp")
+    base_url, root = media_server
+    (root / "whistle.mp4").write_bytes(os.urandom(CHUNK_SIZE * 4))
+    updates = {}
+    items = [DownloadItem(index, f"{base_url}/whistle.mp4") for index in range(2)]
+    summary = DownloadManager(items, build_ydl_options(str(tmp_path)), workers=2,
+                              on_update=record_updates(updates)).run()
+
+    assert sorted(item.index for item in summary.done) == [0, 1]
+    assert updates[0][-1] == ("done", 100.0)
+    # 同じURLでもリストの番号で別のファイルになる
+    assert sorted(os.path.basename(item.path) for item in summary.done) == ["whistle_01.mp4", "whistle_02.mp4"]
+    for item in summary.done:
+        with open(item.path, "rb") as f:
+            assert f.read() == (root / "whistle.mp4").read_bytes()
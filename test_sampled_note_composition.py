@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pydub")
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+from sampled_note_composition import (build_event_table, select_active_events, render_events, iter_render_blocks,
+                                      PitchBank, PrebuiltBank)
+
+def make_score(notes):
+    times = [f"00:00:0{i}:000" for i in range(len(notes))]
+    return pd.DataFrame({"時刻(hh:mm:ss:fff)": times, "音階（国際式）": notes})
+
+def tone(freq):
+    return Sine(freq).to_audio_segment(duration=50).set_frame_rate(8000)
+
+def test_sharp_resolves_to_written_pitch():
+    events = build_event_table(make_score(["C#5", "C5", "D5", "A"]))
+    assert list(events.target_note) == ["C#5", "C5", "D5", "A4"]
+    # PitchBank は基本音（オクターブ4）から楽譜と同じ音高までずらす（C#5 は C4 の+13半音）
+    assert list(events.semitone_diff) == [13, 12, 12, 0]
+
+    names = ["C5", "C#5", "D5", "A4"]
+    bank = PrebuiltBank({name: tone(300 + 50 * i) for i, name in enumerate(names)})
+    active = select_active_events(events, bank, verbose=False)
+    assert list(active) == [0, 1, 2, 3]
+    assert np.array_equal(bank.lookup(events, 0), bank._samples["C#5"])
+
+def test_unknown_spelling_is_rejected():
+    events = build_event_table(make_score(["E#5", "B#4", "F#4"]))
+    assert list(events.target_note) == ["", "", "F#4"]
+    assert list(events.valid) == [False, False, True]
+
+    bank = PitchBank({"E": tone(330), "B": tone(494), "F": tone(349)})
+    assert list(select_active_events(events, bank, verbose=False)) == [2]
+
+def test_sustain_loops_are_evicted_with_pitch_cache():
+    # 音声（50ms）より長い音符ばかりなので、どの音もループで伸ばす
+    events = build_event_table(make_score(["C4", "D4", "C5", "C4"]))
+    bank = PitchBank({"C": tone(262), "D": tone(294)}, max_entries=2)
+    active = select_active_events(events, bank, verbose=False)
+    render_events(events, bank, verbose=False)
+
+    assert bank.evictions == 2
+    assert set(bank._loops) <= set(bank._cache)
+    streamed = np.concatenate(list(iter_render_blocks(events, active, bank, block_frames=3000)))
+    assert set(bank._loops) <= set(bank._cache)
+    assert len(streamed) == 4 * 8000 - 4000
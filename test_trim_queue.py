@@ -0,0 +1,25 @@
+from collections import namedtuple
+
+import pytest
+
+from trim_queue import TrimQueue, TrimJob
+
+FakeProgress = namedtuple("FakeProgress", ["out_time"])
+
+def test_group_progress_is_shared_across_outputs():
+    jobs = [TrimJob(0, 10.0, 14.0, "a.mp4"), TrimJob(1, 20.0, 28.0, "b.mp4"), TrimJob(2, 30.0, 32.0, "c.mp4")]
+    updates = []
+    queue = TrimQueue("input.mp4", jobs, on_update=lambda job: updates.append((job.index, job.progress)))
+
+    # 出力ごとの時刻は 0 から始まるため、最も長い出力（8秒）に対する割合を全ジョブに反映する
+    queue._group_progress(jobs, FakeProgress(out_time=2.0))
+    assert [job.progress for job in jobs] == pytest.approx([0.25, 0.25, 0.25])
+    assert sorted(index for index, _ in updates) == [0, 1, 2]
+
+    queue._group_progress(jobs, FakeProgress(out_time=6.0))
+    assert [job.progress for job in jobs] == pytest.approx([0.75, 0.75, 0.75])
+
+    # 進捗は戻らず、1 を超えない
+    queue._group_progress(jobs, FakeProgress(out_time=1.0))
+    queue._group_progress(jobs[:1], FakeProgress(out_time=100.0))
+    assert [job.progress for job in jobs] == pytest.approx([1.0, 0.75, 0.75])
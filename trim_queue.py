@@ -0,0 +1,254 @@
+import os
+import re
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import ffmpeg
+from video_cut import trim_media, encode_segments, TrimCancelled
+
+# ジョブの状態と表示名
+JOB_STATUS = {
+    "pending": "待機中",
+    "running": "処理中",
+    "done": "完了",
+    "failed": "失敗",
+    "cancelled": "中止",
+}
+
+# 区間リストの列名として認識する名前（小文字で比較）
+START_COLUMNS = ["start", "開始", "開始時間", "開始時間（秒）"]
+END_COLUMNS = ["end", "終了", "終了時間", "終了時間（秒）"]
+
+# 解析結果（音声解析の出力）の列名
+ANALYSIS_TIME_COLUMN = "時刻(hh:mm:ss:fff)"
+ANALYSIS_NOTE_COLUMN = "音階（国際式）"
+
+# 1回のffmpegでまとめて再エンコードする区間の条件（区間の間隔の上限[秒]と1回あたりの最大出力数）
+CLUSTER_GAP_SEC = 30.0
+CLUSTER_MAX_OUTPUTS = 8
+
+class TrimJob:
+    """トリミングのジョブ1件（区間と出力先、状態）"""
+
+    def __init__(self, index, start, end, output_path):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.output_path = output_path
+        self.status = "pending"
+        self.progress = 0.0
+        self.error = None
+        self.mode = None
+
+    def __repr__(self):
+        return f"TrimJob({self.index}, {self.start:.3f}-{self.end:.3f}, {self.status})"
+
+# 一括トリミングの結果
+# done / failed / cancelled: 各状態のジョブのリスト, seconds: 全体の処理時間[秒]
+TrimSummary = namedtuple("TrimSummary", ["done", "failed", "cancelled", "seconds"])
+
+def parse_time_value(value):
+    """秒数（数値・文字列）または「hh:mm:ss:fff」「hh:mm:ss.fff」「mm:ss」形式の時刻を秒に変換"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    match = re.fullmatch(r"(\d+):(\d{2}):(\d{2})[:.](\d{1,3})", text)
+    if match:
+        h, m, s, ms = match.groups()
+        return int(h) * 3600 + int(m) * 60 + int(s) + int(ms.ljust(3, "0")) / 1000
+    parts = text.split(":")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def _find_column(columns, names):
+    lowered = {str(column).strip().lower(): column for column in columns}
+    for name in names:
+        if name.lower() in lowered:
+            return lowered[name.lower()]
+    return None
+
+def segments_from_analysis(df, min_sec=0.5, gap_sec=0.1, pad_sec=0.2):
+    """音声解析の結果から音が続いている区間を求め、(開始, 終了) 秒のリストを返す
+
+    音階が記録されているフレームが gap_sec 以内の間隔で続く範囲を1つの区間とし、前後に pad_sec の余白をつける。
+    min_sec より短い区間は除外する。
+    """
+    times = [parse_time_value(value) for value in df[ANALYSIS_TIME_COLUMN]]
+    notes = df[ANALYSIS_NOTE_COLUMN]
+    voiced = [t for t, note in zip(times, notes) if isinstance(note, str) and note.strip() and note != "無音"]
+    if not voiced:
+        return []
+
+    # フレームの間隔（解析のホップ長）
+    steps = sorted(b - a for a, b in zip(times, times[1:]) if b > a)
+    hop = steps[len(steps) // 2] if steps else 0.0
+
+    segments = []
+    run_start = previous = voiced[0]
+    for t in voiced[1:]:
+        if t - previous > hop + gap_sec:
+            segments.append((run_start, previous + hop))
+            run_start = t
+        previous = t
+    segments.append((run_start, previous + hop))
+    return [(max(0.0, start - pad_sec), end + pad_sec) for start, end in segments if end - start >= min_sec]
+
+def load_segments(path, **analysis_options):
+    """区間リスト（CSV / Excel / Parquet）を読み込み、(開始, 終了) 秒のリストを返す
+
+    「start」「end」（または「開始」「終了」）の列があればその区間を使う。
+    音声解析の結果（時刻と音階の列）を指定した場合は segments_from_analysis で区間を求める。
+    見出しのないCSVは1列目を開始、2列目を終了とする。
+    """
+    import pandas as pd
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".xlsx", ".xls"):
+        df = pd.read_excel(path)
+    elif ext == ".parquet":
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path, dtype=str)
+
+    if ANALYSIS_TIME_COLUMN in df.columns and ANALYSIS_NOTE_COLUMN in df.columns:
+        return segments_from_analysis(df, **analysis_options)
+
+    start_column = _find_column(df.columns, START_COLUMNS)
+    end_column = _find_column(df.columns, END_COLUMNS)
+    if start_column is None or end_column is None:
+        if ext not in (".csv", ".txt") or len(df.columns) < 2:
+            raise ValueError(f"区間の列（start / end）が見つかりません：\n{path}")
+        df = pd.read_csv(path, header=None, dtype=str)
+        start_column, end_column = df.columns[0], df.columns[1]
+
+    segments = []
+    for start, end in zip(df[start_column], df[end_column]):
+        if pd.isna(start) or pd.isna(end):
+            continue
+        start, end = parse_time_value(start), parse_time_value(end)
+        if end > start:
+            segments.append((start, end))
+    return segments
+
+def group_encode_jobs(jobs, gap_sec=CLUSTER_GAP_SEC, max_outputs=CLUSTER_MAX_OUTPUTS):
+    """再エンコードするジョブを、近い区間同士（間隔 gap_sec 以内、最大 max_outputs 件）のまとまりに分ける"""
+    groups = []
+    for job in sorted(jobs, key=lambda job: job.start):
+        group = groups[-1] if groups else None
+        if group and len(group) < max_outputs and job.start - max(j.end for j in group) <= gap_sec:
+            group.append(job)
+        else:
+            groups.append([job])
+    return groups
+
+class TrimQueue:
+    """1つの入力ファイルから複数の区間を切り出すジョブキュー
+
+    ジョブは上限つきのスレッドプール（既定: CPUコア数）で並列に実行する。
+    再エンコードの場合は近い区間をまとめて1回のffmpegで処理し、入力の読み込みとデコードを共有する。
+    on_update: ジョブの状態・進捗（TrimJob.progress, 0〜1）が変わるたびに TrimJob を受け取る関数
+               （ワーカーのスレッドから呼ばれる）
+    """
+
+    def __init__(self, input_path, jobs, mode="encode", workers=None, on_update=None):
+        self.input_path = input_path
+        self.jobs = list(jobs)
+        self.mode = mode
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.on_update = on_update
+        self._cancel = threading.Event()
+
+    @classmethod
+    def from_segments(cls, input_path, segments, output_paths, **kwargs):
+        """(開始, 終了) のリストと出力先のリストからキューを作成"""
+        jobs = [TrimJob(index, start, end, output_path)
+                for index, ((start, end), output_path) in enumerate(zip(segments, output_paths))]
+        return cls(input_path, jobs, **kwargs)
+
+    def cancel(self):
+        """未実行のジョブを中止し、実行中のffmpegも終了させる"""
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _update(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        if status == "done":
+            job.progress = 1.0
+        if self.on_update is not None:
+            self.on_update(job)
+
+    def _progress(self, job, fraction):
+        job.progress = max(job.progress, min(max(fraction, 0.0), 1.0))
+        if self.on_update is not None:
+            self.on_update(job)
+
+    def _group_progress(self, jobs, progress):
+        """1回のffmpegで処理しているまとまりの進捗を、まとまり全体の割合として各ジョブに反映する
+
+        各出力は自分の -ss で時刻が 0 から始まるため、out_time は出力ごとの長さ（入力上の位置ではない）。
+        どの出力の進捗かは区別できないので、最も長い出力に対する割合をまとまり内の全ジョブで共有する。
+        """
+        fraction = progress.out_time / max(job.end - job.start for job in jobs)
+        for job in jobs:
+            self._progress(job, fraction)
+
+    def _run_group(self, group):
+        """ジョブのまとまりを実行（再エンコードは1回のffmpeg、それ以外は1件ずつ）"""
+        for job in group:
+            if self.cancelled:
+                self._update(job, "cancelled")
+            else:
+                self._update(job, "running")
+        pending = [job for job in group if job.status == "running"]
+        if not pending:
+            return
+        try:
+            if self.mode == "encode":
+                encode_segments(self.input_path, [(job.output_path, job.start, job.end) for job in pending],
+                                cancel=self._cancel,
+                                on_progress=lambda progress: self._group_progress(pending, progress))
+                for job in pending:
+                    job.mode = "encode"
+                    self._update(job, "done")
+                return
+            for job in pending:
+                if self.cancelled:
+                    self._update(job, "cancelled")
+                    continue
+                job.mode, _ = trim_media(self.input_path, job.output_path, job.start, job.end,
+                                         mode=self.mode, cancel=self._cancel,
+                                         on_progress=lambda progress, job=job: self._progress(
+                                             job, (progress.percent or 0.0) / 100))
+                self._update(job, "done")
+        except TrimCancelled:
+            for job in pending:
+                if job.status == "running":
+                    self._update(job, "cancelled")
+        except ffmpeg.Error as e:
+            message = e.stderr.decode(errors="replace") if e.stderr else str(e)
+            for job in pending:
+                if job.status == "running":
+                    self._update(job, "failed", message)
+        except Exception as e:
+            for job in pending:
+                if job.status == "running":
+                    self._update(job, "failed", str(e))
+
+    def run(self):
+        """全てのジョブを実行し、TrimSummary を返す（中止した場合も実行中のジョブの終了を待ってから返す）"""
+        started = time.perf_counter()
+        groups = group_encode_jobs(self.jobs) if self.mode == "encode" else [[job] for job in self.jobs]
+        with ThreadPoolExecutor(max_workers=min(self.workers, max(len(groups), 1))) as executor:
+            for future in [executor.submit(self._run_group, group) for group in groups]:
+                future.result()
+
+        by_status = {status: [job for job in self.jobs if job.status == status] for status in JOB_STATUS}
+        return TrimSummary(by_status["done"], by_status["failed"], by_status["cancelled"],
+                           time.perf_counter() - started)
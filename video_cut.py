@@ -0,0 +1,236 @@
+import os
+import shutil
+import tempfile
+import ffmpeg
+from ffmpeg_runner import FFmpegRunner, FFmpegCancelled, FFmpegError
+
+# トリミングが中止されたときの例外（FFmpegRunner の中止と同じ）
+TrimCancelled = FFmpegCancelled
+
+# トリミングの方式（表示名 → 方式）
+# "encode": 全体を再エンコード（従来どおり、正確だが遅い）
+# "copy": 無劣化コピー。開始位置は直前のキーフレームに合わせる（非常に速いが開始が少し早まることがある）
+# "smart": スマートカット。開始位置から最初のキーフレームまでだけ再エンコードし、残りはコピーしてつなぐ（正確かつ速い）
+TRIM_MODES = {
+    "再エンコード": "encode",
+    "高速（無劣化コピー）": "copy",
+    "スマートカット": "smart",
+}
+
+# キーフレームと見なす時刻のずれの許容範囲（秒）
+KEYFRAME_TOLERANCE = 0.01
+
+# キーフレームを探す範囲（開始位置より前、秒）。GOPがこれより長い動画では探索範囲を広げる
+KEYFRAME_SEARCH_SEC = 30.0
+
+# スマートカットに対応するコーデック（映像, 音声）
+# 再エンコードした先頭部分とコピーした残りを -c copy で連結するため、先頭を元と同じ形式で作れるものに限る
+SMART_CUT_VIDEO_CODECS = {"h264": "libx264"}
+SMART_CUT_AUDIO_CODECS = {"aac": "aac"}
+
+# ffprobe の H.264 プロファイル名 → libx264 の -profile:v
+H264_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+    "High 10": "high10",
+    "High 4:2:2": "high422",
+    "High 4:4:4 Predictive": "high444",
+}
+
+def has_video(probe):
+    """ffmpeg.probe の結果に映像ストリームがあるか"""
+    return any(s['codec_type'] == 'video' for s in probe['streams'])
+
+def probe_start_time(probe):
+    """ffmpeg.probe の結果からコンテナの開始時刻（秒）を返す（-ss はこの時刻からの相対位置）"""
+    try:
+        return float(probe.get('format', {}).get('start_time', 0.0))
+    except (TypeError, ValueError):
+        return 0.0
+
+def probe_keyframes(input_path, start, end, search_sec=KEYFRAME_SEARCH_SEC, start_time=0.0):
+    """最初の映像ストリームのキーフレームの時刻（秒, 昇順）を [start - search_sec, end] の範囲で返す
+
+    ffprobe でパケットの情報（時刻とフラグ）だけを読むため、デコードは行わない。
+    start_time: コンテナの開始時刻（probe_start_time）。pts_time は絶対時刻なので、これを引いて
+    -ss と同じ基準（先頭を 0 とする時刻）にそろえる（TSファイルなど開始時刻が 0 でない場合）
+    """
+    interval = f"{max(0.0, start - search_sec) + start_time}%{end + start_time}"
+    probe = ffmpeg.probe(input_path, select_streams="v:0", read_intervals=interval,
+                         show_entries="packet=pts_time,flags")
+    keyframes = {float(packet['pts_time']) - start_time for packet in probe.get('packets', [])
+                 if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A')}
+    return sorted(keyframes)
+
+def smart_cut_options(probe):
+    """スマートカットの先頭部分を元の動画と同じ形式で再エンコードするための出力オプションを返す
+
+    映像が H.264（プロファイル・レベル・画素形式が分かるもの）、音声が AAC（または音声なし）の場合だけ対応する。
+    それ以外（VP9 / AV1 / HEVC など）は連結すると後半が壊れるため None を返す（再エンコードに切り替える）。
+    """
+    video = next((s for s in probe['streams'] if s['codec_type'] == 'video'), None)
+    audio = next((s for s in probe['streams'] if s['codec_type'] == 'audio'), None)
+    if video is None or video.get('codec_name') not in SMART_CUT_VIDEO_CODECS:
+        return None
+    profile = H264_PROFILES.get(video.get('profile'))
+    level = video.get('level')
+    pix_fmt = video.get('pix_fmt')
+    if profile is None or not level or level < 0 or not pix_fmt:
+        return None
+
+    options = {
+        'vcodec': SMART_CUT_VIDEO_CODECS[video['codec_name']],
+        'profile:v': profile,
+        'level': f"{level / 10:.1f}",
+        'pix_fmt': pix_fmt,
+        's': f"{video['width']}x{video['height']}",
+    }
+    # タイムベースをそろえる（MP4 のトラックのタイムスケール）
+    time_base = video.get('time_base', '')
+    if time_base.startswith('1/'):
+        options['video_track_timescale'] = time_base[2:]
+    if audio is None:
+        options['an'] = None
+        return options
+    if audio.get('codec_name') not in SMART_CUT_AUDIO_CODECS:
+        return None
+    options.update({
+        'acodec': SMART_CUT_AUDIO_CODECS[audio['codec_name']],
+        'ar': audio['sample_rate'],
+        'ac': audio['channels'],
+    })
+    return options
+
+def plan_cut(keyframes, start, end, tolerance=KEYFRAME_TOLERANCE):
+    """スマートカットの区間分けを決める
+
+    コピーで切り出せるのはキーフレームから始まる区間だけなので、開始位置から最初のキーフレームまでを再エンコードし、
+    そこから終了位置までをコピーする（終了側は途中のフレームで切ってもデコードできるため再エンコードは不要）。
+    戻り値: (方式, (開始, 終了)) のリスト。方式は "encode"（再エンコード）か "copy"（コピー）
+    """
+    inner = [k for k in keyframes if start - tolerance <= k < end - tolerance]
+    if not inner:
+        return [("encode", (start, end))]
+
+    copy_start = inner[0]
+    if copy_start - start <= tolerance:
+        return [("copy", (copy_start, end))]
+    return [("encode", (start, copy_start)), ("copy", (copy_start, end))]
+
+def run_ffmpeg(stream, cancel=None, on_progress=None, duration=None, cleanup_paths=()):
+    """ffmpegを FFmpegRunner で実行して終了を待つ（ffmpeg.run と同じく失敗時は ffmpeg.Error）
+
+    cancel: threading.Event。セットされたら実行中のffmpegを終了させ、cleanup_paths を削除して TrimCancelled を送出する
+    on_progress: FFmpegProgress を受け取る関数（duration を指定すると進捗率と残り時間も計算される）
+    """
+    if cancel is not None and cancel.is_set():
+        raise TrimCancelled()
+    runner = FFmpegRunner(stream, duration=duration, on_progress=on_progress, cancel=cancel,
+                          cleanup_paths=cleanup_paths)
+    try:
+        runner.run()
+    except FFmpegError as e:
+        raise ffmpeg.Error('ffmpeg', b'', e.stderr)
+
+def encode_segment(input_path, output_path, start, end, cancel=None, on_progress=None, options=None):
+    """区間を再エンコード（H.264 / AAC）して書き出す
+
+    options: 出力オプション（smart_cut_options）。指定すると既定のコーデック設定の代わりに使う
+    """
+    stream = ffmpeg.input(input_path, ss=start, t=end - start)
+    options = options or {'acodec': 'aac', 'vcodec': 'libx264'}
+    run_ffmpeg(ffmpeg.output(stream, output_path, loglevel='error', **options), cancel,
+               on_progress, end - start, [output_path])
+
+def encode_segments(input_path, segments, cancel=None, on_progress=None):
+    """複数の区間を1回のffmpegで再エンコードする（入力の読み込みとデコードを全ての出力で共有）
+
+    segments: (出力パス, 開始, 終了) のリスト。最初の区間の開始位置までシークし、そこから各出力を切り出す
+    """
+    origin = min(start for _, start, _ in segments)
+    source = ffmpeg.input(input_path, ss=origin)
+    outputs = [ffmpeg.output(source, output_path, ss=start - origin, t=end - start,
+                             acodec='aac', vcodec='libx264', loglevel='error')
+               for output_path, start, end in segments]
+    run_ffmpeg(ffmpeg.merge_outputs(*outputs), cancel, on_progress,
+               max(end for _, _, end in segments) - origin, [output_path for output_path, _, _ in segments])
+
+def copy_segment(input_path, output_path, start, end, cancel=None, on_progress=None):
+    """区間を再エンコードせずにコピーして書き出す（映像は start 以前の直近のキーフレームから始まる）"""
+    stream = ffmpeg.input(input_path, ss=start, t=end - start)
+    run_ffmpeg(ffmpeg.output(stream, output_path, c='copy', avoid_negative_ts='make_zero', loglevel='error'),
+               cancel, on_progress, end - start, [output_path])
+
+def concat_segments(segment_paths, output_path, cancel=None):
+    """同じ形式の区間ファイルを再エンコードせずに連結する（concat demuxer）"""
+    list_path = os.path.join(os.path.dirname(segment_paths[0]), "segments.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    stream = ffmpeg.input(list_path, f='concat', safe=0)
+    run_ffmpeg(ffmpeg.output(stream, output_path, c='copy', loglevel='error'), cancel,
+               cleanup_paths=[output_path])
+
+def trim_media(input_path, output_path, start, end, mode="encode", cancel=None, on_progress=None):
+    """start〜end 秒を切り出して output_path に保存し、(実際に使った方式, 実際の開始時刻) を返す
+
+    mode: "encode" / "copy" / "smart"（TRIM_MODES を参照）
+    音声のみのファイルはどのパケットからでも切り出せるため、"copy" / "smart" では常にそのままコピーする。
+    "copy" / "smart" で範囲内にキーフレームがない場合は再エンコードに切り替える。
+    "smart" は H.264 / AAC の動画だけに対応し、それ以外のコーデックでは再エンコードに切り替える（smart_cut_options）。
+    cancel: threading.Event。セットされると実行中のffmpegを止め、途中までの出力を削除して TrimCancelled を送出する
+    on_progress: ffmpegの進捗（FFmpegProgress）を受け取る関数。スマートカットでは区間ごとに 0〜100% を繰り返す
+    """
+    if mode == "encode":
+        encode_segment(input_path, output_path, start, end, cancel, on_progress)
+        return "encode", start
+
+    probe = ffmpeg.probe(input_path)
+    if not has_video(probe):
+        copy_segment(input_path, output_path, start, end, cancel, on_progress)
+        return "copy", start
+
+    options = None
+    if mode == "smart":
+        options = smart_cut_options(probe)
+        if options is None:
+            encode_segment(input_path, output_path, start, end, cancel, on_progress)
+            return "encode", start
+
+    keyframes = probe_keyframes(input_path, start, end, start_time=probe_start_time(probe))
+    if mode == "copy":
+        before = [k for k in keyframes if k <= start + KEYFRAME_TOLERANCE]
+        if not before:
+            encode_segment(input_path, output_path, start, end, cancel, on_progress)
+            return "encode", start
+        copy_segment(input_path, output_path, before[-1], end, cancel, on_progress)
+        return "copy", before[-1]
+
+    plan = plan_cut(keyframes, start, end)
+    if len(plan) == 1:
+        method, (segment_start, segment_end) = plan[0]
+        if method == "copy":
+            copy_segment(input_path, output_path, segment_start, segment_end, cancel, on_progress)
+        else:
+            encode_segment(input_path, output_path, segment_start, segment_end, cancel, on_progress)
+        return method, start
+
+    # 開始側の区間だけ再エンコードし、コピーした区間と連結する
+    work_dir = tempfile.mkdtemp(prefix="smartcut_")
+    try:
+        ext = os.path.splitext(output_path)[1] or ".mp4"
+        segment_paths = []
+        for index, (method, (segment_start, segment_end)) in enumerate(plan):
+            path = os.path.join(work_dir, f"part{index:02d}{ext}")
+            if method == "copy":
+                copy_segment(input_path, path, segment_start, segment_end, cancel, on_progress)
+            else:
+                encode_segment(input_path, path, segment_start, segment_end, cancel, on_progress, options)
+            segment_paths.append(path)
+        concat_segments(segment_paths, output_path, cancel)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return "smart", start
@@ -1,17 +1,20 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import yt_dlp
 import os
 import re
 from datetime import datetime
-import pytz
 import sys
+import threading
+from startup import schedule_prewarm
+from ffmpeg_runner import tk_callback
+from download_manager import (DownloadManager, DownloadItem, DOWNLOAD_STATUS, FFMPEG_DIR,
+                              parse_download_list, build_ydl_options, find_ffmpeg)
 
 class VideoDownloader:
-    def __init__(self, root):
+    def __init__(self, root, prewarm=True):
         self.root = root
         self.root.title("動画ダウンローダー")
-        self.root.geometry("600x500")
+        self.root.geometry("700x720")
         
         # メインフレーム
         main_frame = ttk.Frame(root, padding="10")
@@ -62,16 +65,41 @@ class VideoDownloader:
                        value="audio").grid(row=5, column=0, sticky=tk.W)
         
         # ダウンロードボタン
-        ttk.Button(main_frame, text="ダウンロード", command=self.download).grid(row=6, column=0, pady=20)
+        ttk.Button(main_frame, text="ダウンロード", command=self.download).grid(row=6, column=0, pady=10)
+        
+        # 一括ダウンロード（1行に1件「URL [開始] [終了]」、複数を並列にダウンロード）
+        batch_frame = ttk.LabelFrame(main_frame, text="一括ダウンロード（1行に1件: URL [開始] [終了]）", padding="5")
+        batch_frame.grid(row=7, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+        self.batch_text = tk.Text(batch_frame, height=5, width=80)
+        self.batch_text.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E))
+        ttk.Button(batch_frame, text="一括ダウンロード", command=self.batch_download).grid(row=1, column=0, sticky=tk.W, pady=5)
+        self.cancel_button = ttk.Button(batch_frame, text="中止", command=self.cancel_download, state="disabled")
+        self.cancel_button.grid(row=1, column=1, sticky=tk.W, pady=5)
+        
+        # ダウンロードごとの状態と進捗
+        self.item_tree = ttk.Treeview(main_frame, columns=("url", "range", "status", "progress"),
+                                      show="headings", height=6)
+        for column, text, width in [("url", "URL / タイトル", 330), ("range", "時間指定", 130),
+                                    ("status", "状態", 100), ("progress", "進捗", 80)]:
+            self.item_tree.heading(column, text=text)
+            self.item_tree.column(column, width=width, anchor=tk.W)
+        self.item_tree.grid(row=8, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
         
         # 進行状況
         self.progress_var = tk.DoubleVar()
         self.progress_bar = ttk.Progressbar(main_frame, length=400, variable=self.progress_var)
-        self.progress_bar.grid(row=7, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+        self.progress_bar.grid(row=9, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
         
         # ステータスラベル
         self.status_var = tk.StringVar(value="準備完了")
-        ttk.Label(main_frame, textvariable=self.status_var).grid(row=8, column=0, sticky=tk.W, pady=5)
+        ttk.Label(main_frame, textvariable=self.status_var).grid(row=10, column=0, sticky=tk.W, pady=5)
+        
+        # 実行中の DownloadManager
+        self.manager = None
+        
+        # yt_dlp は読み込みに時間がかかるため、画面の表示後にバックグラウンドで先読みする
+        if prewarm:
+            schedule_prewarm(self.root, ["yt_dlp", "pytz"])
 
     def validate_youtube_url(self, url):
         patterns = [
@@ -82,6 +110,8 @@ class VideoDownloader:
         return any(bool(re.match(pattern, url)) for pattern in patterns)
 
     def load_video_info(self):
+        import yt_dlp
+        
         url = self.url_var.get().strip()
         if not url:
             messagebox.showerror("エラー", "URLを入力してください")
@@ -147,133 +177,148 @@ class VideoDownloader:
         except:
             raise ValueError("Invalid time format")
 
-    def progress_hook(self, d):
-        if d['status'] == 'downloading':
-            # ダウンロード進捗を計算
-            if 'total_bytes' in d:
-                percent = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                self.progress_var.set(percent)
-                self.status_var.set(f"ダウンロード中... {percent:.1f}%")
-            elif 'downloaded_bytes' in d:
-                self.status_var.set(f"ダウンロード中... {d['downloaded_bytes'] / 1024 / 1024:.1f}MB")
-        elif d['status'] == 'finished':
-            self.status_var.set("変換中...")
-            print(f"[成功] ダウンロード完了: {d['filename']}")
-
     def download(self):
+        """入力欄のURLを1件ダウンロード（別スレッドで実行し、画面は固まらない）"""
         url = self.url_var.get().strip()
         if not url:
             messagebox.showerror("エラー", "URLを入力してください")
             return
-
         try:
-            # 時間をパース
             start_seconds = self.parse_time(self.start_time_var.get())
             end_seconds = self.parse_time(self.end_time_var.get())
-            
-            if start_seconds >= end_seconds:
-                messagebox.showerror("エラー", "終了時間は開始時間より後である必要があります")
-                return
-                
-            # 現在の日本時間を取得してフォルダ名を生成
-            jst = pytz.timezone('Asia/Tokyo')
-            now = datetime.now(jst)
-            download_dir = f"downloads_{now.strftime('%Y%m%d%H%M')}"
-            
-            # ダウンロードディレクトリの作成
-            if not os.path.exists(download_dir):
-                os.makedirs(download_dir)
-                print(f"[情報] 保存フォルダを作成: {download_dir}")
+        except ValueError as e:
+            messagebox.showerror("エラー", f"時間形式が正しくありません: {str(e)}")
+            return
+        if end_seconds and start_seconds >= end_seconds:
+            messagebox.showerror("エラー", "終了時間は開始時間より後である必要があります")
+            return
+        self.start_downloads([DownloadItem(0, url, start_seconds, end_seconds or None)])
 
-            # 時間指定文字列を作成（HH:MM:SS形式）
-            start_time = self.format_time_for_download(start_seconds)
-            end_time = self.format_time_for_download(end_seconds)
+    def batch_download(self):
+        """リスト欄の複数のURL（1行に1件「URL [開始] [終了]」）を並列にダウンロード"""
+        try:
+            items = parse_download_list(self.batch_text.get("1.0", tk.END))
+        except ValueError as e:
+            messagebox.showerror("エラー", f"時間形式が正しくありません: {str(e)}")
+            return
+        if not items:
+            messagebox.showerror("エラー", "URLを入力してください")
+            return
+        invalid = [item.url for item in items if not self.validate_youtube_url(item.url)]
+        if invalid:
+            messagebox.showerror("エラー", "無効なYouTube URLです:\n" + "\n".join(invalid[:5]))
+            return
+        self.start_downloads(items)
 
-            # ffmpegのパスを設定
-            ffmpeg_dir = r'C:\ffmpeg\bin'
-            ffmpeg_exe = os.path.join(ffmpeg_dir, 'ffmpeg.exe')
-            
-            if os.path.exists(ffmpeg_exe):
-                has_ffmpeg = True
-                print(f"[情報] ffmpegを検出: {ffmpeg_exe}")
-                os.environ["PATH"] = os.pathsep.join([ffmpeg_dir, os.environ.get("PATH", "")])
-                yt_dlp.utils.std_headers['PATH'] = os.environ["PATH"]
-            else:
-                has_ffmpeg = False
-                print(f"[警告] ffmpegが見つかりません。以下の場所にffmpeg.exeを配置してください:")
-                print(f"- {ffmpeg_exe}")
+    def start_downloads(self, items):
+        if self.manager is not None:
+            messagebox.showerror("エラー", "ダウンロードを実行中です")
+            return
 
-            # yt-dlp オプションの設定
-            ydl_opts = {
-                'progress_hooks': [self.progress_hook],
-                'outtmpl': os.path.join(download_dir, '%(title)s.%(ext)s'),
-                'quiet': True,
-                'no_warnings': True,
-            }
+        # 現在の日本時間を取得してフォルダ名を生成
+        import pytz
+        jst = pytz.timezone('Asia/Tokyo')
+        now = datetime.now(jst)
+        download_dir = f"downloads_{now.strftime('%Y%m%d%H%M')}"
 
-            if has_ffmpeg:
-                ydl_opts.update({
-                    'postprocessors': [{
-                        'key': 'FFmpegVideoConvertor',
-                        'preferedformat': 'mp4',
-                    }],
-                    'postprocessor_args': {
-                        'FFmpegVideoConvertor': [
-                            '-ss', self.format_time_for_download(start_seconds),
-                            '-t', str(end_seconds - start_seconds)
-                        ]
-                    }
-                })
-                print("[情報] 時間指定ダウンロードを使用")
+        # ダウンロードディレクトリの作成
+        if not os.path.exists(download_dir):
+            os.makedirs(download_dir)
+            print(f"[情報] 保存フォルダを作成: {download_dir}")
 
+        ffmpeg_exe = find_ffmpeg()
+        if ffmpeg_exe:
+            print(f"[情報] ffmpegを検出: {ffmpeg_exe}")
+        else:
+            print(f"[警告] ffmpegが見つかりません。以下の場所にffmpeg.exeを配置してください:")
+            print(f"- {os.path.join(FFMPEG_DIR, 'ffmpeg.exe')}")
             if self.download_type.get() == "audio":
-                if has_ffmpeg:
-                    ydl_opts.update({
-                        'format': 'bestaudio/best',
-                        'postprocessors': [{
-                            'key': 'FFmpegExtractAudio',
-                            'preferredcodec': 'mp3',
-                            'preferredquality': '192',
-                        }],
-                    })
-                    print("[情報] 音声モードで準備中（MP3変換あり）...")
-                else:
-                    ydl_opts.update({
-                        'format': 'bestaudio/best',
-                    })
-                    print("[情報] 音声モードで準備中（MP3変換なし）...")
-                    messagebox.showwarning(
-                        "警告",
-                        "FFmpegが見つかりません。音声ファイルはMP3に変換されず、元のフォーマットでダウンロードされます。"
-                    )
-            else:
-                # 動画モードの設定
-                ydl_opts.update({
-                    'format': 'best[ext=mp4]/best',  # 単一フォーマットを指定
-                })
-                print("[情報] 動画モードで準備中...")
+                messagebox.showwarning(
+                    "警告",
+                    "FFmpegが見つかりません。音声ファイルはMP3に変換されず、元のフォーマットでダウンロードされます。"
+                )
+            if any(item.has_range for item in items):
+                print("[警告] ffmpegがないため時間指定は無視されます")
 
+        ydl_opts = build_ydl_options(download_dir, self.download_type.get(), ffmpeg_exe)
+        self.manager = DownloadManager(items, ydl_opts, on_update=tk_callback(self.root, self.show_item_progress),
+                                       ffmpeg_exe=ffmpeg_exe)
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                print(f"[情報] ダウンロード開始: {url}")
-                print(f"[情報] 時間指定: {self.start_time_var.get()} - {self.end_time_var.get()}")
-                ydl.download([url])
+        self.item_tree.delete(*self.item_tree.get_children())
+        for item in items:
+            self.item_tree.insert("", tk.END, iid=str(item.index),
+                                  values=(item.url, self.format_range(item), DOWNLOAD_STATUS[item.status], ""))
+        self.cancel_button.config(state="normal")
+        self.progress_var.set(0)
+        self.status_var.set(f"0 / {len(items)} 件")
+        print(f"[情報] ダウンロード開始: {len(items)}件")
 
-            self.status_var.set("ダウンロード完了!")
-            self.progress_var.set(100)
-            messagebox.showinfo("成功", "ダウンロードが完了しました")
-            
-        except ValueError as e:
-            error_message = f"時間形式が正しくありません: {str(e)}"
-            print(f"[エラー] {error_message}")
-            messagebox.showerror("エラー", error_message)
+        # キューの実行は1本のスレッドで管理し、ダウンロードはマネージャー内の上限つきプールで並列に実行する
+        threading.Thread(target=self.download_thread, args=(self.manager,), daemon=True).start()
+
+    def format_range(self, item):
+        if not item.has_range:
+            return "全体"
+        start = self.format_time_for_download(int(item.start or 0))
+        end = self.format_time_for_download(int(item.end)) if item.end is not None else "最後"
+        return f"{start} - {end}"
+
+    def download_thread(self, manager):
+        try:
+            summary = manager.run()
+            self.root.after(0, self.download_completed, summary)
         except Exception as e:
-            error_message = str(e)
-            print(f"[エラー] {type(e).__name__}: {error_message}")
+            print(f"[エラー] {type(e).__name__}: {str(e)}")
+            self.root.after(0, self.download_completed, None)
+            self.root.after(0, messagebox.showerror, "エラー", f"ダウンロード中にエラーが発生しました: {str(e)}")
+
+    def show_item_progress(self, item):
+        """DownloadItem の状態・進捗を一覧と全体の進行状況に反映"""
+        manager = self.manager
+        if manager is None:
+            return
+        if item.status == "downloading" and not item.total_bytes and item.downloaded_bytes:
+            progress = f"{item.downloaded_bytes / 1024 / 1024:.1f}MB"
+        elif item.status in ("downloading", "trimming"):
+            progress = f"{item.progress:.1f}%"
+        else:
+            progress = ""
+        label = item.title or item.url
+        self.item_tree.item(str(item.index), values=(label, self.format_range(item),
+                                                     DOWNLOAD_STATUS[item.status], progress))
+        if item.status == "done":
+            print(f"[成功] ダウンロード完了: {item.path}")
+        elif item.status == "failed":
+            print(f"[エラー] {item.url}: {item.error}")
+
+        finished = sum(i.status in ("done", "failed", "cancelled") for i in manager.items)
+        self.progress_var.set(sum(100.0 if i.status in ("done", "failed", "cancelled") else i.progress
+                                  for i in manager.items) / len(manager.items))
+        self.status_var.set(f"{finished} / {len(manager.items)} 件")
+
+    def cancel_download(self):
+        """実行中のダウンロードを中止"""
+        if self.manager is not None:
+            self.manager.cancel()
+            self.status_var.set("中止しています...")
+
+    def download_completed(self, summary):
+        self.manager = None
+        self.cancel_button.config(state="disabled")
+        self.progress_var.set(0)
+        if summary is None:
             self.status_var.set("エラーが発生しました")
-            messagebox.showerror("エラー", f"ダウンロード中にエラーが発生しました: {error_message}")
-        finally:
-            self.progress_var.set(0)
+            return
+
+        self.status_var.set("ダウンロード完了!" if not summary.failed and not summary.cancelled else "準備完了")
+        lines = [f"完了: {len(summary.done)}件, 失敗: {len(summary.failed)}件, 中止: {len(summary.cancelled)}件"
+                 f"（{summary.seconds:.1f}秒）"]
+        for item in summary.failed[:5]:
+            lines.append(f"失敗 {item.url}: {(item.error or '').strip()[:200]}")
+        if summary.failed:
+            messagebox.showerror("エラー", "\n".join(lines))
+        else:
+            messagebox.showinfo("成功", "\n".join(lines))
 
 def main():
     root = tk.Tk()
@@ -281,4 +326,4 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -4,26 +4,37 @@ import ffmpeg
 import threading
 import os
 import json
-import numpy as np
-from scipy.io import wavfile
-from scipy.fft import fft
-import openpyxl
 from datetime import datetime, timedelta
 import traceback  # スタックトレース出力用
 import sys  # システムエラー出力用
+from analysis_options import ANALYSIS_FORMATS, PITCH_METHODS
+from video_cut import TRIM_MODES, trim_media, run_ffmpeg, TrimCancelled
+from ffmpeg_runner import tk_callback
+from trim_queue import TrimQueue, JOB_STATUS, load_segments
+from startup import schedule_prewarm
+
+# 音声解析で使うモジュール（トリミングだけなら不要なので起動時には読み込まず、画面の表示後に先読みする）
+ANALYSIS_MODULES = ["numpy", "scipy.fft", "openpyxl", "audio_io", "audio_analysis", "note_mapping"]
 
 class VideoTrimmerGUI:
-    def __init__(self, root):
+    def __init__(self, root, prewarm=True):
         self.root = root
         self.root.title("動画トリマー")
-        self.root.geometry("600x300")
+        self.root.geometry("600x360")
         
         # 変数の初期化
         self.input_path = tk.StringVar()
         self.start_time = tk.StringVar(value="0.0")
         self.end_time = tk.StringVar()
+        self.analysis_format = tk.StringVar(value=".xlsx")
+        self.pitch_method = tk.StringVar(value="peak")
+        self.trim_mode = tk.StringVar(value="再エンコード")
+        self.trim_queue = None  # 実行中の一括トリミング
+        self.job_cancels = set()  # 実行中のffmpegジョブごとの中止用（threading.Event）
         
         self.setup_ui()
+        if prewarm:
+            schedule_prewarm(self.root, ANALYSIS_MODULES)
     
     def setup_ui(self):
         # 入力ファイル選択
@@ -43,6 +54,10 @@ class VideoTrimmerGUI:
         ttk.Label(time_frame, text="終了時間（秒）:").pack(side="left")
         ttk.Entry(time_frame, textvariable=self.end_time, width=10).pack(side="left", padx=5)
         
+        # トリミングの方式（再エンコード / 無劣化コピー / スマートカット）
+        ttk.Combobox(time_frame, textvariable=self.trim_mode, values=list(TRIM_MODES),
+                     state="readonly", width=18).pack(side="left", padx=5)
+        
         # 動画情報表示
         self.info_label = ttk.Label(self.root, text="")
         self.info_label.pack(pady=5)
@@ -64,6 +79,26 @@ class VideoTrimmerGUI:
         # フーリエ変換ボタン
         ttk.Button(button_frame, text="フーリエ変換", command=self.analyze_audio).pack(side="left", padx=5)
         
+        # 解析結果の出力形式
+        ttk.Combobox(button_frame, textvariable=self.analysis_format, values=ANALYSIS_FORMATS,
+                     state="readonly", width=8).pack(side="left", padx=5)
+        
+        # 周波数の推定方法（peak: スペクトルの最大, yin: 基本周波数）
+        ttk.Combobox(button_frame, textvariable=self.pitch_method, values=PITCH_METHODS,
+                     state="readonly", width=6).pack(side="left", padx=5)
+        
+        # 一括トリミング（区間リストのCSV・解析結果から複数の区間を切り出す）
+        queue_frame = ttk.Frame(self.root)
+        queue_frame.pack(pady=5)
+        ttk.Button(queue_frame, text="一括トリミング...", command=self.batch_trim).pack(side="left", padx=5)
+        
+        # トリミング・音声抽出・解析を1回のデコードでまとめて実行
+        ttk.Button(queue_frame, text="切り出し＋抽出＋解析", command=self.trim_extract_analyze).pack(side="left", padx=5)
+        self.cancel_button = ttk.Button(queue_frame, text="中止", command=self.cancel_job, state="disabled")
+        self.cancel_button.pack(side="left", padx=5)
+        self.queue_label = ttk.Label(queue_frame, text="")
+        self.queue_label.pack(side="left", padx=5)
+        
         # プログレスバー
         self.progress_var = tk.DoubleVar()
         self.progress_bar = ttk.Progressbar(
@@ -167,33 +202,64 @@ class VideoTrimmerGUI:
             return
         
         # トリミング処理を別スレッドで実行
-        threading.Thread(target=self.trim_video_thread).start()
+        threading.Thread(target=self.trim_video_thread, args=(self.start_job(),)).start()
+    
+    def start_job(self):
+        """ffmpegジョブの開始: ジョブ専用の中止用 Event を登録し、中止ボタンを有効にして返す
+
+        トリミング・音声抽出・一括処理は同時に実行できるため、Event はジョブごとに持ち、中止ボタンで全てセットする。
+        """
+        cancel = threading.Event()
+        self.job_cancels.add(cancel)
+        self.cancel_button.config(state="normal")
+        return cancel
+    
+    def finish_job(self, cancel):
+        """ffmpegジョブの終了: ジョブの Event を外し、実行中のジョブがなくなったら中止ボタンと進捗表示を元に戻す"""
+        self.job_cancels.discard(cancel)
+        if self.job_cancels or self.trim_queue is not None:
+            return
+        self.cancel_button.config(state="disabled")
+        self.queue_label.config(text="")
+    
+    def show_ffmpeg_progress(self, progress):
+        """ffmpegの進捗（FFmpegProgress）を表示"""
+        if progress.percent is not None:
+            self.progress_var.set(progress.percent)
+        text = f"{progress.percent:.0f}%" if progress.percent is not None else f"{progress.out_time:.1f}秒"
+        if progress.speed:
+            text += f"  速度 {progress.speed:.2f}x"
+        if progress.eta is not None:
+            text += f"  残り 約{progress.eta:.0f}秒"
+        self.queue_label.config(text=text)
+    
+    def job_cancelled(self):
+        self.progress_var.set(0)
+        messagebox.showinfo("中止", "処理を中止しました。途中までの出力ファイルは削除しました。")
     
-    def trim_video_thread(self):
+    def trim_video_thread(self, cancel):
         try:
             start_time = float(self.start_time.get())
             end_time = float(self.end_time.get())
             input_path = self.input_path.get()
-            output_path = self.generate_output_path(input_path)
-            duration = end_time - start_time
-            
-            # FFmpegストリームを設定
-            stream = ffmpeg.input(input_path, ss=start_time, t=duration)
+            trim_mode = TRIM_MODES[self.trim_mode.get()]
+            # コピー系の方式では入力と同じ形式で出力する（再エンコードのときだけMP4）
+            ext = os.path.splitext(input_path)[1] if trim_mode != "encode" else ".mp4"
+            output_path = self.generate_output_path(input_path, ext=ext or ".mp4")
             
-            # 音声と映像を同時に処理
-            stream = ffmpeg.output(stream, output_path,
-                                 acodec='aac',       # 音声コーデック
-                                 vcodec='libx264',   # 映像コーデック
-                                 loglevel='error')   # エラーのみ表示
-            
-            # FFmpegコマンドを実行
-            ffmpeg.run(stream, capture_stdout=True, capture_stderr=True, overwrite_output=True)
+            # 選択した方式で切り出す（コピー・スマートカットはキーフレームの位置に応じて再エンコードを最小限にする）
+            mode, actual_start = trim_media(input_path, output_path, start_time, end_time,
+                                            mode=trim_mode, cancel=cancel,
+                                            on_progress=tk_callback(self.root, self.show_ffmpeg_progress))
+            print(f"トリミング方式: {mode}, 開始: {actual_start:.3f}秒")
             
             if os.path.exists(output_path):
                 self.root.after(0, self.trim_completed, output_path)
             else:
                 raise Exception("出力ファイルが生成されませんでした。")
             
+        except TrimCancelled:
+            self.root.after(0, self.job_cancelled)
         except ffmpeg.Error as e:
             error_msg = f"FFmpegエラー：\n{e.stderr.decode()}"
             print(f"[ERROR] {error_msg}")  # ターミナルに出力
@@ -202,6 +268,110 @@ class VideoTrimmerGUI:
             error_msg = f"エラーが発生しました：\n{str(e)}"
             print(f"[ERROR] {error_msg}")  # ターミナルに出力
             self.root.after(0, self.show_error, error_msg)
+        finally:
+            self.root.after(0, self.finish_job, cancel)
+    
+    def generate_output_paths(self, input_path, count, suffix="_trimming", ext=".mp4"):
+        """未使用の連番の出力パスを count 個作成（generate_output_path と同じ命名）"""
+        paths = []
+        while len(paths) < count:
+            path = self.generate_output_path(input_path, suffix=suffix, ext=ext)
+            # まだファイルが存在しないため、同じパスを返さないように予約しておく
+            open(path, "a").close()
+            paths.append(path)
+        return paths
+    
+    def batch_trim(self):
+        if self.trim_queue is not None:
+            messagebox.showerror("エラー", "一括トリミングを実行中です。")
+            return
+        
+        input_path = self.input_path.get()
+        if not input_path or not os.path.exists(input_path):
+            messagebox.showerror("エラー", "入力ファイルを選択してください。")
+            return
+        
+        segments_path = filedialog.askopenfilename(
+            title="区間リスト（CSV）または解析結果を選択",
+            filetypes=[
+                ("区間リスト・解析結果", "*.csv *.xlsx *.parquet"),
+                ("すべてのファイル", "*.*")
+            ]
+        )
+        if not segments_path:
+            return
+        
+        try:
+            segments = load_segments(segments_path)
+        except Exception as e:
+            messagebox.showerror("エラー", f"区間リストを読み込めません：\n{segments_path}\n{str(e)}")
+            return
+        if not segments:
+            messagebox.showerror("エラー", "切り出す区間がありません。")
+            return
+        
+        ext = os.path.splitext(input_path)[1] if TRIM_MODES[self.trim_mode.get()] != "encode" else ".mp4"
+        output_paths = self.generate_output_paths(input_path, len(segments), ext=ext or ".mp4")
+        self.trim_queue = TrimQueue.from_segments(
+            input_path, segments, output_paths, mode=TRIM_MODES[self.trim_mode.get()],
+            on_update=lambda job: self.root.after(0, self.batch_trim_progress))
+        self.cancel_button.config(state="normal")
+        self.queue_label.config(text=f"0 / {len(segments)} 件")
+        
+        # キューの実行は1本のスレッドで管理し、ffmpegはキュー内の上限つきプールで並列に実行する
+        threading.Thread(target=self.batch_trim_thread, args=(self.trim_queue,), daemon=True).start()
+    
+    def batch_trim_thread(self, queue):
+        try:
+            summary = queue.run()
+            self.root.after(0, self.batch_trim_completed, summary)
+        except Exception as e:
+            error_msg = f"エラーが発生しました：\n{str(e)}"
+            print(f"[ERROR] {error_msg}")  # ターミナルに出力
+            self.root.after(0, self.batch_trim_completed, None)
+            self.root.after(0, self.show_error, error_msg)
+    
+    def batch_trim_progress(self):
+        queue = self.trim_queue
+        if queue is None:
+            return
+        finished = sum(job.status in ("done", "failed", "cancelled") for job in queue.jobs)
+        running = [job for job in queue.jobs if job.status == "running"]
+        # 終了したジョブは1件分、処理中のジョブは進捗の割合だけ全体の進捗に加える
+        self.progress_var.set(sum(1.0 if job.status in ("done", "failed", "cancelled") else job.progress
+                                  for job in queue.jobs) / len(queue.jobs) * 100)
+        details = ", ".join(f"#{job.index + 1} {job.progress * 100:.0f}%" for job in running[:4])
+        self.queue_label.config(text=f"{finished} / {len(queue.jobs)} 件（{JOB_STATUS['running']}: {len(running)}件"
+                                     + (f" {details}" if details else "") + "）")
+    
+    def cancel_job(self):
+        """実行中の一括トリミングとffmpegジョブを中止"""
+        if self.trim_queue is not None:
+            self.trim_queue.cancel()
+        for cancel in self.job_cancels:
+            cancel.set()
+        self.queue_label.config(text="中止しています...")
+    
+    def batch_trim_completed(self, summary):
+        self.trim_queue = None
+        if not self.job_cancels:
+            self.cancel_button.config(state="disabled")
+        self.progress_var.set(0)
+        self.queue_label.config(text="")
+        if summary is None:
+            return
+        
+        # 失敗・中止したジョブの予約済みの空ファイルを削除
+        for job in summary.failed + summary.cancelled:
+            if os.path.exists(job.output_path) and os.path.getsize(job.output_path) == 0:
+                os.remove(job.output_path)
+        
+        lines = [f"完了: {len(summary.done)}件, 失敗: {len(summary.failed)}件, 中止: {len(summary.cancelled)}件"
+                 f"（{summary.seconds:.1f}秒）"]
+        for job in summary.failed[:5]:
+            lines.append(f"失敗 {job.start:.1f}〜{job.end:.1f}秒: {(job.error or '').strip()[:200]}")
+        messagebox.showinfo("一括トリミング", "\n".join(lines))
+        self.update_output_path()
     
     def show_error(self, message):
         self.progress_var.set(0)
@@ -226,9 +396,9 @@ class VideoTrimmerGUI:
             return
         
         # 音声抽出処理を別スレッドで実行
-        threading.Thread(target=self.extract_audio_thread).start()
+        threading.Thread(target=self.extract_audio_thread, args=(self.start_job(),)).start()
     
-    def extract_audio_thread(self):
+    def extract_audio_thread(self, cancel):
         try:
             input_path = self.input_path.get()
             output_path = self.generate_output_path(input_path, suffix="_audio", ext=".mp3")
@@ -242,14 +412,17 @@ class VideoTrimmerGUI:
                                vn=None,              # 映像を除外
                                loglevel='error')     # エラーのみ表示
             
-            # FFmpegコマンドを実行
-            ffmpeg.run(stream, capture_stdout=True, capture_stderr=True, overwrite_output=True)
+            # FFmpegを非同期に実行し、-progress の出力から進捗を表示（中止されたら途中までの出力を削除）
+            duration = float(ffmpeg.probe(input_path)['format'].get('duration', 0)) or None
+            run_ffmpeg(stream, cancel, tk_callback(self.root, self.show_ffmpeg_progress), duration, [output_path])
             
             if os.path.exists(output_path):
                 self.root.after(0, self.audio_extraction_completed, output_path)
             else:
                 raise Exception("出力ファイルが生成されませんでした。")
             
+        except TrimCancelled:
+            self.root.after(0, self.job_cancelled)
         except ffmpeg.Error as e:
             error_msg = f"FFmpegエラー：\n{e.stderr.decode()}"
             print(f"[ERROR] {error_msg}")  # ターミナルに出力
@@ -258,6 +431,8 @@ class VideoTrimmerGUI:
             error_msg = f"エラーが発生しました：\n{str(e)}"
             print(f"[ERROR] {error_msg}")  # ターミナルに出力
             self.root.after(0, self.show_error, error_msg)
+        finally:
+            self.root.after(0, self.finish_job, cancel)
     
     def audio_extraction_completed(self, output_path):
         self.progress_var.set(0)
@@ -267,25 +442,68 @@ class VideoTrimmerGUI:
         # 出力パスの表示を更新
         self.update_output_path()
 
+    def trim_extract_analyze(self):
+        input_path = self.input_path.get()
+        if not input_path or not os.path.exists(input_path):
+            messagebox.showerror("エラー", "入力ファイルを選択してください。")
+            return
+        
+        try:
+            start_time = float(self.start_time.get())
+            end_time = float(self.end_time.get())
+        except ValueError:
+            messagebox.showerror("エラー", "開始時間と終了時間は数値で入力してください。")
+            return
+        
+        if start_time >= end_time:
+            messagebox.showerror("エラー", "開始時間は終了時間より前である必要があります。")
+            return
+        
+        threading.Thread(target=self.trim_extract_analyze_thread,
+                         args=(start_time, end_time, self.start_job())).start()
+    
+    def trim_extract_analyze_thread(self, start_time, end_time, cancel):
+        try:
+            from media_pipeline import trim_extract_analyze
+            
+            input_path = self.input_path.get()
+            written = trim_extract_analyze(
+                input_path, start_time, end_time,
+                video_path=self.generate_output_path(input_path),
+                audio_path=self.generate_output_path(input_path, suffix="_audio", ext=".mp3"),
+                analysis_path=self.generate_output_path(input_path, suffix="_analysis",
+                                                        ext=self.analysis_format.get()),
+                method=self.pitch_method.get(),
+                progress=lambda percent: self.root.after(0, self.progress_var.set, percent),
+                cancel=cancel)
+            self.root.after(0, self.trim_extract_analyze_completed, written)
+            
+        except TrimCancelled:
+            self.root.after(0, self.job_cancelled)
+        except ffmpeg.Error as e:
+            error_msg = f"FFmpegエラー：\n{e.stderr.decode(errors='replace') if e.stderr else e}"
+            print(f"[ERROR] {error_msg}")  # ターミナルに出力
+            self.root.after(0, self.show_error, error_msg)
+        except Exception as e:
+            error_msg = f"エラーが発生しました：\n{str(e)}\nスタックトレース:\n{traceback.format_exc()}"
+            print(f"[ERROR] {error_msg}")  # ターミナルに出力
+            self.root.after(0, self.show_error, error_msg)
+        finally:
+            self.root.after(0, self.finish_job, cancel)
+    
+    def trim_extract_analyze_completed(self, written):
+        self.progress_var.set(0)
+        labels = {"video": "動画", "audio": "音声", "analysis": "解析結果"}
+        lines = [f"{labels[key]}: {path}" for key, path in written.items() if path]
+        messagebox.showinfo("完了", "切り出し・音声抽出・解析が完了しました。\n" + "\n".join(lines))
+        self.update_output_path()
+
     def frequency_to_note(self, freq):
         """周波数を音階に変換（国際式とドレミ式）"""
         if freq == 0:
             return "無音", "無音"
-        
-        # A4(440Hz)を基準に周波数から音階を計算
-        notes_international = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        notes_doremi = ['ド', 'ド#', 'レ', 'レ#', 'ミ', 'ファ', 'ファ#', 'ソ', 'ソ#', 'ラ', 'ラ#', 'シ']
-        
-        a4_freq = 440
-        steps = round(12 * np.log2(freq / a4_freq))
-        octave = 4 + (steps + 9) // 12
-        note_index = (steps + 9) % 12
-        
-        # 国際式とドレミ式の音名を生成
-        note_international = f"{notes_international[note_index]}{octave}"
-        note_doremi = f"{notes_doremi[note_index]}{octave}"
-        
-        return note_international, note_doremi
+        from note_mapping import frequency_to_note
+        return frequency_to_note(freq)
 
     def analyze_audio(self):
         input_path = self.input_path.get()
@@ -302,89 +520,26 @@ class VideoTrimmerGUI:
 
     def analyze_audio_thread(self):
         try:
-            input_path = self.input_path.get()
-            
-            # 入力がMP3の場合、一時的なWAVファイルに変換
-            if input_path.lower().endswith('.mp3'):
-                wav_path = input_path.rsplit('.', 1)[0] + '_temp.wav'
-                stream = ffmpeg.input(input_path)
-                stream = ffmpeg.output(stream, wav_path, acodec='pcm_s16le', ac=1)
-                ffmpeg.run(stream, capture_stdout=True, capture_stderr=True, overwrite_output=True)
-                input_path = wav_path
-            
-            # WAVファイルを読み込み
-            sample_rate, audio_data = wavfile.read(input_path)
-            if len(audio_data.shape) > 1:
-                audio_data = audio_data[:, 0]  # ステレオの場合は最初のチャンネルを使用
+            from audio_io import open_audio_blocks
+            from audio_analysis import iter_analyze_blocks, AnalysisStreamWriter
+            from note_mapping import midi_to_note_names
             
-            # 分析のパラメータ
-            window_size = int(0.05 * sample_rate)  # 50ms
-            hop_size = int(0.025 * sample_rate)    # 25ms
-            
-            # Excelファイルを作成
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "音声解析結果"
-            
-            # ヘッダーを設定
-            headers = ["時刻(hh:mm:ss:fff)", "周波数 (Hz)", "振幅 (dB)", "音階（国際式）", "音階（ドレミ式）"]
-            for col, header in enumerate(headers, 1):
-                ws.cell(row=1, column=col, value=header)
-            
-            # データ解析と書き込み
-            row = 2
-            total_windows = (len(audio_data) - window_size) // hop_size
-            
-            for i in range(0, len(audio_data) - window_size, hop_size):
-                # 進捗更新
-                progress = (i / (len(audio_data) - window_size)) * 100
-                self.root.after(0, self.progress_var.set, progress)
-                
-                # 時間窓でのデータを取得
-                window = audio_data[i:i + window_size]
-                
-                # フーリエ変換
-                spectrum = fft(window)
-                freq = np.fft.fftfreq(window_size, 1/sample_rate)
-                
-                # 正の周波数のみを使用
-                pos_mask = freq > 0
-                freq = freq[pos_mask]
-                spectrum = np.abs(spectrum[pos_mask])
-                
-                # 時刻を計算（ミリ秒まで）
-                time_sec = i / sample_rate
-                total_ms = int(time_sec * 1000)
-                hours = total_ms // 3600000
-                minutes = (total_ms % 3600000) // 60000
-                seconds = (total_ms % 60000) // 1000
-                milliseconds = total_ms % 1000
-                time_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}:{milliseconds:03d}"
-                
-                # 最大振幅とその周波数を特定
-                max_idx = np.argmax(spectrum)
-                max_amplitude = spectrum[max_idx]
-                
-                # データをExcelに書き込み（振幅が0の場合は周波数と音階を空欄に）
-                ws.cell(row=row, column=1, value=time_str)  # 時刻は常に記録
-                ws.cell(row=row, column=3, value=f"{max_amplitude:.1f}")  # 振幅は常に記録
-                
-                if max_amplitude > 0:  # 振幅が0より大きい場合のみ周波数と音階を記録
-                    max_freq = freq[max_idx]
-                    note_international, note_doremi = self.frequency_to_note(max_freq)
-                    ws.cell(row=row, column=2, value=f"{max_freq:.1f}")
-                    ws.cell(row=row, column=4, value=note_international)
-                    ws.cell(row=row, column=5, value=note_doremi)
-                
-                row += 1
+            input_path = self.input_path.get()
             
-            # Excelファイルを保存
-            excel_path = self.generate_output_path(self.input_path.get(), suffix="_analysis", ext=".xlsx")
-            wb.save(excel_path)
+            excel_path = self.generate_output_path(self.input_path.get(), suffix="_analysis",
+                                                   ext=self.analysis_format.get())
             
-            # 一時ファイルの削除
-            if input_path.endswith('_temp.wav'):
-                os.remove(input_path)
+            # 音声をブロックごとに読み込み（WAVはメモリマップ、それ以外はffmpegのパイプ）、
+            # 解析結果もブロックごとに書き出す（拡張子で形式を選択: .xlsx / .csv / .parquet）
+            sample_rate, total_samples, blocks = open_audio_blocks(input_path)
+            results = iter_analyze_blocks(
+                blocks, sample_rate, total_samples=total_samples, method=self.pitch_method.get(),
+                progress=lambda percent: self.root.after(0, self.progress_var.set, percent))
+            with AnalysisStreamWriter(excel_path) as writer:
+                for result in results:
+                    note_international, note_doremi = midi_to_note_names(result["midi"])
+                    writer.write(result["time_ms"], result["frequency"], result["amplitude"],
+                                 note_international, note_doremi)
             
             self.root.after(0, self.analysis_completed, excel_path)
             
@@ -401,4 +556,4 @@ class VideoTrimmerGUI:
 if __name__ == "__main__":
     root = tk.Tk()
     app = VideoTrimmerGUI(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
\ No newline at end of file
@@ -0,0 +1,350 @@
+import os
+import sys
+import time
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
+from scipy.io import wavfile
+from audio_io import decode_audio
+from audio_analysis import find_loudest_segments
+from pitch_detection import estimate_f0
+from sustain_engine import SustainLoop
+from note_mapping import SCALE_NOTES, JUST_RATIOS, BASE_C4, DOREMI_TO_INTERNATIONAL
+
+def load_whistle(filename):
+    """警笛の音声を読み込み、(サンプリングレート, 最大振幅で正規化したモノラルの float32 配列) を返す"""
+    sample_rate, data = decode_audio(filename)
+    if len(data.shape) > 1:
+        data = data[:, 0]
+    return sample_rate, data.astype(np.float32) / np.max(np.abs(data))
+
+def estimate_base_frequency(data, sample_rate, budget_sec=0.1):
+    """最も強い区間をYINで解析して基本周波数を推定し、PitchEstimate（周波数, 信頼度, ...）を返す
+
+    周期が見つからない場合は、その区間のスペクトルで最も強い周波数を信頼度0として返す。
+    """
+    estimate = estimate_f0(data, sample_rate, budget_sec=budget_sec)
+    if estimate.frequency > 0:
+        return estimate
+
+    _, segment = extract_best_segment(data, sample_rate)
+    spectrum = np.abs(np.fft.rfft(segment))
+    spectrum[0] = 0  # 直流成分は除外
+    peak = np.argmax(spectrum) * sample_rate / len(segment)
+    return estimate._replace(frequency=float(peak), confidence=0.0)
+
+def extract_best_segment(data, sample_rate, segment_sec=1.0, window_sec=0.1):
+    """音声から最も強い部分（window_sec 窓のエネルギー最大の位置）から segment_sec 秒分を取り出し、(開始位置, セグメント) を返す"""
+    window_size = int(window_sec * sample_rate)
+    start, _ = find_loudest_segments(data, window_size, top_k=1)[0]
+    
+    segment_length = int(segment_sec * sample_rate)
+    if start + segment_length > len(data):
+        start = len(data) - segment_length
+    return start, data[start:start+segment_length]
+
+def render_sustained_note(shifted_segment, target_length, fade_samples, out=None, crossfade=None):
+    """短いセグメントをループさせて target_length に伸ばし、冒頭と末尾をフェードして int16 で返す
+
+    ループ境界はゼロクロスに合わせ、等パワークロスフェードでつなぐ（SustainLoop）。
+    out: 書き込み先の int16 配列（長さ target_length、大きな出力バッファのスライスなど）。省略時は新しく確保する
+    crossfade: ループ境界のクロスフェードのサンプル数（既定: セグメント長の1%）
+    """
+    if out is None:
+        out = np.empty(target_length, dtype=np.int16)
+    if crossfade is None:
+        crossfade = len(shifted_segment) // 100
+    loop = SustainLoop(shifted_segment, crossfade)
+    
+    # ループさせた音声を int16 に変換しながら出力先へ直接書き込む
+    loop.render(out, gain=32767)
+    
+    # 冒頭と末尾のみフェードイン/アウト（その部分だけ float で作り直す）
+    fade_samples = min(fade_samples, target_length)
+    if fade_samples > 0:
+        edge = np.empty(fade_samples, dtype=np.float32)
+        loop.render(edge)
+        np.multiply(edge * np.linspace(0, 1, fade_samples), 32767, out=out[:fade_samples], casting="unsafe")
+        loop.render(edge, offset=target_length - fade_samples)
+        np.multiply(edge * np.linspace(1, 0, fade_samples), 32767, out=out[-fade_samples:], casting="unsafe")
+    return out
+
+# プロセスプールの各ワーカーが共有するピッチシフター（プロセス起動時に1回だけ設定）
+_worker_shifter = None
+
+def _init_shift_worker(shifter):
+    """ワーカー初期化: 解析済みのSTFTをワーカーごとに1回だけ受け取る"""
+    global _worker_shifter
+    _worker_shifter = shifter
+
+def _shift_in_worker(n_steps):
+    """ワーカープロセスでピッチシフトを実行"""
+    return shift_segment(_worker_shifter, n_steps)
+
+def shift_segment(shifter, n_steps):
+    """解析済みのセグメントを n_steps 半音（小数可）ピッチシフトし、(結果, 処理時間[秒]) を返す"""
+    started = time.perf_counter()
+    shifted = shifter.shift(n_steps)
+    return shifted, time.perf_counter() - started
+
+def iter_shifted_degrees(segment, sample_rate, n_steps_list, workers=None, use_processes=False):
+    """全音階分のピッチシフトを並列に実行し、(番号, 結果, 処理時間[秒]) を完了した順に返すジェネレーター
+
+    セグメントのSTFTは最初に1回だけ計算し、全ての音階で共有する。
+    workers: 並列数（既定: 音階数とCPUコア数の小さい方）。1 の場合は並列化せず順番に処理する
+    use_processes: True ならプロセスプール、False（既定）ならスレッドプールを使う
+                   1音のシフトは数十ミリ秒で終わる一方、プロセスの起動では各ワーカーが librosa を読み込み直す
+                   （Windows では数秒かかる）ため、既定は起動コストのないスレッドプールとする
+    """
+    from pitch_shift_engine import PitchShifter  # librosa の読み込みはピッチシフトを行う時点まで遅らせる
+
+    shifter = PitchShifter(segment, sample_rate)
+    if workers is None:
+        workers = min(len(n_steps_list), os.cpu_count() or 1)
+    if workers <= 1 or len(n_steps_list) <= 1:
+        for index, n_steps in enumerate(n_steps_list):
+            shifted, seconds = shift_segment(shifter, n_steps)
+            yield index, shifted, seconds
+        return
+
+    if use_processes:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_shift_worker, initargs=(shifter,))
+        submit = lambda n_steps: executor.submit(_shift_in_worker, n_steps)
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        submit = lambda n_steps: executor.submit(shift_segment, shifter, n_steps)
+    with executor:
+        futures = {submit(n_steps): index for index, n_steps in enumerate(n_steps_list)}
+        for future in as_completed(futures):
+            shifted, seconds = future.result()
+            yield futures[future], shifted, seconds
+
+def find_nearest_note(freq):
+    """周波数に最も近い純正律の音（ド〜上のド）を (ドレミ式の音名, 周波数比) で返す"""
+    octave = int(np.log2(freq/BASE_C4))
+    norm_freq = freq / (2**octave)
+    
+    # 純正律の各音との差が最小の音を選ぶ（同じ差なら先の音）
+    diffs = np.abs(norm_freq - BASE_C4 * np.array(JUST_RATIOS))
+    nearest = int(np.argmin(diffs))
+    return SCALE_NOTES[nearest], JUST_RATIOS[nearest]
+
+def get_international_note(note_name, freq):
+    """ドレミ式の音名と周波数から国際式の音名（例: "C5"）を求める"""
+    octave = int(np.log2(freq/BASE_C4)) + 4
+    return f"{DOREMI_TO_INTERNATIONAL[note_name]}{octave}"
+
+def make_scale_dir(output_dir, label=None):
+    """音階の出力フォルダ（年月日時分形式、例: 202401011230_onkai）を作成して返す
+
+    label を指定するとフォルダ名に含める（例: 202401011230_whistle_onkai）。同じ分に複数の録音を処理する場合に使う
+    """
+    date_str = datetime.now().strftime("%Y%m%d%H%M")
+    scale_dir = os.path.join(output_dir, f"{date_str}_{label}_onkai" if label else f"{date_str}_onkai")
+    os.makedirs(scale_dir, exist_ok=True)
+    return scale_dir
+
+def generate_scale(original_data, sample_rate, base_freq, base_note, base_ratio, scale_dir,
+                   workers=None, use_processes=False, verbose=True):
+    """基本音から純正律の音階（ド〜上のド）を生成し、各音と全体の音階を scale_dir に保存する
+
+    戻り値: (全体の音階ファイルのパス, 音階情報の辞書のリスト)
+    """
+    if verbose:
+        print(f"\n音階を生成中... 検出周波数: {base_freq:.1f}Hz ({base_note})")
+    
+    notes_base = SCALE_NOTES
+    notes = [note + 'ー' for note in notes_base]
+    shift_ratios = [ratio / base_ratio for ratio in JUST_RATIOS]
+    
+    scale_info = []
+    current_time = 0.0
+    if verbose:
+        print("\n音階の周波数:")
+    
+    # 音声の長さと処理パラメータ
+    duration = 10.0  # 各音の長さを10秒に設定
+    target_length = int(duration * sample_rate)
+    fade_time = 0.3  # フェードイン/アウトの時間
+    fade_samples = int(fade_time * sample_rate)
+    
+    # 元の音声から最も強い部分（100ms窓）を見つけ、そこから1秒分のデータを取得（全体で1回だけ実行）
+    _, best_segment = extract_best_segment(original_data, sample_rate)
+    
+    silence_samples = int(0.5 * sample_rate)  # 0.5秒の無音
+    note_filenames = []
+    n_steps_list = []
+    for note, note_base, ratio in zip(notes, notes_base, shift_ratios):
+        freq = base_freq * ratio
+        if verbose:
+            print(f"{note}: {freq:.1f}Hz")
+        
+        international = get_international_note(note_base, freq)
+        scale_info.append({
+            '時刻 (秒)': f"{current_time:.1f}",
+            '周波数 (Hz)': f"{freq:.1f}",
+            '振幅': 1.0,
+            '音階（国際式）': international,
+            '音階（ドレミ式）': note
+        })
+        note_filenames.append(os.path.join(scale_dir, f"{international}.wav"))
+        
+        # シフト量をセント値で計算
+        cents = 1200 * np.log2(ratio)
+        n_steps_list.append(cents/100)
+        
+        current_time += 10.5  # 音の長さ(10.0秒) + 無音区間(0.5秒)
+    
+    # 全体の音階（各音の後に0.5秒の無音）を入れるバッファを最初に1回だけ確保し、各音を自分の位置へ直接書き込む
+    stride = target_length + silence_samples
+    scale_complete = np.zeros(stride * len(n_steps_list), dtype=np.int16)
+    
+    # ベストセグメントに全音階分のピッチシフトを並列で適用し、終わったものから順に保存
+    started = time.perf_counter()
+    for index, shifted_segment, seconds in iter_shifted_degrees(
+            best_segment, sample_rate, n_steps_list, workers=workers, use_processes=use_processes):
+        # 1秒のセグメントを10秒に拡張（音質を維持）し、冒頭と末尾をフェードして int16 に変換
+        offset = index * stride
+        shifted = render_sustained_note(shifted_segment, target_length, fade_samples,
+                                        out=scale_complete[offset:offset + target_length])
+        
+        # 個別の音階ファイルとして保存（全体のバッファのスライスをそのまま書き出す）
+        wavfile.write(note_filenames[index], sample_rate, shifted)
+        if verbose:
+            print(f"保存: {note_filenames[index]}（ピッチシフト {seconds:.2f}秒）")
+    if verbose:
+        print(f"ピッチシフト完了: 合計 {time.perf_counter() - started:.2f}秒")
+    
+    # 完全な音階をWAVファイルとして保存
+    complete_scale_file = os.path.join(scale_dir, "complete_scale.wav")
+    wavfile.write(complete_scale_file, sample_rate, scale_complete)
+    if verbose:
+        print(f"\n完全な音階を保存しました: {complete_scale_file}")
+    
+    return complete_scale_file, scale_info
+
+def export_scale_info(scale_info, scale_dir):
+    """音階情報を scale_dir/scale_info.xlsx に出力してパスを返す"""
+    import pandas as pd
+
+    excel_file = os.path.join(scale_dir, "scale_info.xlsx")
+    pd.DataFrame(scale_info).to_excel(excel_file, index=False)
+    return excel_file
+
+def process_whistle(input_file, output_dir=None, label=None, workers=None, use_processes=False,
+                    export_excel=True, verbose=True):
+    """警笛の録音1つを分析して音階を生成する（GUIなしで実行できる一連の処理）
+
+    output_dir: 出力先（既定: 録音と同じフォルダ）。その中に年月日時分形式の *_onkai フォルダを作成する
+    戻り値: 基本周波数・信頼度・最も近い音・出力ファイルなどの辞書
+    """
+    if verbose:
+        print(f"音声ファイルを分析中: {input_file}")
+    sample_rate, data = load_whistle(input_file)
+    estimate = estimate_base_frequency(data, sample_rate)
+    base_freq = estimate.frequency
+    note, ratio = find_nearest_note(base_freq)
+    if verbose:
+        print(f"検出された基本周波数: {base_freq:.1f}Hz（信頼度 {estimate.confidence:.2f}）, 最も近い音階: {note}")
+
+    scale_dir = make_scale_dir(output_dir or os.path.dirname(os.path.abspath(input_file)), label)
+    complete_scale_file, scale_info = generate_scale(data, sample_rate, base_freq, note, ratio, scale_dir,
+                                                     workers=workers, use_processes=use_processes,
+                                                     verbose=verbose)
+    return {
+        "input": input_file,
+        "base_freq": base_freq,
+        "confidence": estimate.confidence,
+        "note": note,
+        "scale_dir": scale_dir,
+        "complete_scale": complete_scale_file,
+        "scale_info": scale_info,
+        "excel": export_scale_info(scale_info, scale_dir) if export_excel else None,
+    }
+
+# 一括処理で対象とする録音の拡張子
+WHISTLE_EXTENSIONS = (".wav", ".mp3", ".m4a")
+
+def find_whistle_files(paths):
+    """ファイルとフォルダ（直下の録音）の指定から、処理する録音のパスのリストを作成"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.lower().endswith(WHISTLE_EXTENSIONS)))
+        else:
+            files.append(path)
+    return files
+
+def _process_whistle_job(input_file, output_dir, shift_workers):
+    """一括処理のワーカー: 録音ごとにフォルダ名へファイル名を含めて処理し、進捗表示は親プロセスに任せる"""
+    label = os.path.splitext(os.path.basename(input_file))[0]
+    return process_whistle(input_file, output_dir=output_dir, label=label, workers=shift_workers,
+                           use_processes=False, verbose=False)
+
+def process_whistle_batch(input_files, output_dir=None, jobs=None, shift_workers=1, verbose=True):
+    """複数の録音を並列に処理し、(成功した結果のリスト, 失敗した (パス, エラー) のリスト) を返す
+
+    jobs: 同時に処理する録音の数（既定: CPUコア数）。1 の場合は順番に処理する
+    shift_workers: 録音ごとのピッチシフトのスレッド数（録音単位で並列化するため既定は 1）
+    """
+    jobs = min(jobs or os.cpu_count() or 1, max(len(input_files), 1))
+    results, failures = [], []
+
+    def report(input_file, result=None, error=None):
+        if error is not None:
+            failures.append((input_file, error))
+            if verbose:
+                print(f"  失敗: {input_file}: {error}")
+        else:
+            results.append(result)
+            if verbose:
+                print(f"  完了: {input_file} -> {result['note']} ({result['base_freq']:.1f}Hz), {result['scale_dir']}")
+
+    if jobs <= 1:
+        for input_file in input_files:
+            try:
+                report(input_file, _process_whistle_job(input_file, output_dir, shift_workers))
+            except Exception as e:
+                report(input_file, error=e)
+        return results, failures
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_process_whistle_job, input_file, output_dir, shift_workers): input_file
+                   for input_file in input_files}
+        for future in as_completed(futures):
+            try:
+                report(futures[future], future.result())
+            except Exception as e:
+                report(futures[future], error=e)
+    return results, failures
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="警笛の録音（ファイルまたはフォルダ）から純正律の音階を一括生成します")
+    parser.add_argument("inputs", nargs="+", help="警笛の録音ファイル、または録音を含むフォルダ（WAV/MP3/M4A）")
+    parser.add_argument("-o", "--output-dir", help="出力先（既定: 各録音と同じフォルダ）")
+    parser.add_argument("-j", "--jobs", type=int, help="同時に処理する録音の数（既定: CPUコア数）")
+    parser.add_argument("--shift-workers", type=int, default=1, help="録音ごとのピッチシフトの並列数（既定: 1）")
+    parser.add_argument("-q", "--quiet", action="store_true", help="進捗を表示しない")
+    args = parser.parse_args(argv)
+
+    input_files = find_whistle_files(args.inputs)
+    if not input_files:
+        print("処理する録音が見つかりません")
+        return 1
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    if not args.quiet:
+        print(f"{len(input_files)}件の録音を処理します")
+    results, failures = process_whistle_batch(input_files, output_dir=args.output_dir, jobs=args.jobs,
+                                              shift_workers=args.shift_workers, verbose=not args.quiet)
+    if not args.quiet:
+        print(f"完了: {len(results)}件, 失敗: {len(failures)}件（{time.perf_counter() - started:.2f}秒）")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())